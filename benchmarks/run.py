@@ -0,0 +1,359 @@
+"""Benchmarks of the hot paths of knighted.
+
+Usage::
+
+    python benchmarks/run.py            # prints results
+    python benchmarks/run.py --check    # fails on regressions against baseline.json
+    python benchmarks/run.py --update   # stores results as the new baseline
+
+Each case reports operations per second, and bytes allocated per operation
+(the peak of memory traced while running one operation, averaged, minus
+what running an empty operation costs).
+Speed depends on the machine, allocations do not, so --check is much
+stricter on the latter.
+
+The time of a cold ``import knighted`` is measured in fresh interpreters,
+--check fails when it exceeds a fixed budget.
+"""
+
+import argparse
+import asyncio
+import json
+import pathlib
+import subprocess
+import sys
+import tracemalloc
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Any
+
+here = pathlib.Path(__file__).parent
+sys.path.insert(0, str(here.parent))
+
+from knighted import Injector, annotate, attr, attr_lazy, lazy  # noqa: E402
+
+BASELINE = here / "baseline.json"
+#: seconds allowed to import knighted, asyncio included
+IMPORT_BUDGET = 0.2
+CASES = {}
+
+
+def case(name):
+    def register(setup):
+        CASES[name] = setup
+        return setup
+
+    return register
+
+
+class StatsInjector(Injector):
+    track_stats = True
+
+
+def loaded_injector(count=20, cls=Injector):
+    services = cls()
+    for i in range(count):
+        services["service%d" % i] = i
+    return services
+
+
+def annotated(count):
+    names = ["service%d" % i for i in range(count)]
+    params = ", ".join("s%d" % i for i in range(count))
+    namespace: dict = {}
+    exec("def fun(%s):\n    return None" % params, namespace)
+    return annotate(*names)(namespace["fun"])
+
+
+def get_cached_case(cls):
+    async def setup():
+        services = loaded_injector(cls=cls)
+
+        async def op():
+            await services.get("service0")
+
+        return op
+
+    return setup
+
+
+def get_nowait_case(cls):
+    async def setup():
+        services = loaded_injector(cls=cls)
+
+        async def op():
+            services.get_nowait("service0")
+
+        return op
+
+    return setup
+
+
+case("get cached")(get_cached_case(Injector))
+case("get cached with stats")(get_cached_case(StatsInjector))
+case("get_nowait")(get_nowait_case(Injector))
+case("get_nowait with stats")(get_nowait_case(StatsInjector))
+
+
+@case("get uncached")
+async def get_uncached():
+    services = Injector()
+    services.factory("foo", lambda: "foo", singleton=False, inline=True)
+
+    async def op():
+        await services.get("foo")
+
+    return op
+
+
+@case("get prefix:arg")
+async def get_prefixed():
+    services = Injector()
+    services.factory("user", lambda id: id, singleton=False, inline=True)
+    names = ["user:%d" % i for i in range(100)]
+
+    async def op():
+        for name in names:
+            await services.get(name)
+
+    return op
+
+
+@case("get batch of 100")
+async def get_batched():
+    services = Injector()
+    services.factory(
+        "user", lambda ids: {id: id for id in ids}, singleton=False, batch=True, inline=True
+    )
+    names = ["user:%d" % i for i in range(100)]
+
+    async def op():
+        await asyncio.gather(*map(services.get, names))
+
+    return op
+
+
+@case("scope create and get")
+async def scope_get():
+    services = loaded_injector()
+
+    async def op():
+        scope = services.scope()
+        scope["user"] = "user"
+        await scope.get("service0")
+
+    return op
+
+
+def apply_case(count, cls=Injector):
+    async def setup():
+        services = loaded_injector(count, cls)
+        fun = annotated(count)
+
+        async def op():
+            await services.apply(fun)
+
+        return op
+
+    return setup
+
+
+for count in (0, 5, 20):
+    case("apply %d markers" % count)(apply_case(count))
+case("apply 20 markers with stats")(apply_case(20, StatsInjector))
+
+
+def rare_dependency_case(marker):
+    async def setup():
+        services = loaded_injector()
+        services.factory("reporter", lambda: object(), singleton=False, inline=True)
+
+        @annotate("service0", reporter=marker("reporter"))
+        def handle(service0, reporter):
+            return service0
+
+        async def op():
+            await services.apply(handle)
+
+        return op
+
+    return setup
+
+
+case("apply rare dependency")(rare_dependency_case(str))
+case("apply rare lazy dependency")(rare_dependency_case(lazy))
+
+
+@case("partial call")
+async def partial_call():
+    services = loaded_injector()
+    parted = services.partial(annotated(5))
+
+    async def op():
+        await parted()
+
+    return op
+
+
+@case("attr dataclass")
+async def attr_dataclass():
+    services = loaded_injector()
+
+    @dataclass
+    class Foo:
+        service0: Any = attr("service0")
+        service1: Any = attr("service1")
+
+    async def op():
+        await services.apply(Foo)
+
+    return op
+
+
+@case("attr_lazy access")
+async def attr_lazy_access():
+    services = loaded_injector()
+
+    class Foo:
+        service0: Any = attr_lazy("service0")
+
+    async def op():
+        with services.auto():
+            await Foo().service0
+
+    return op
+
+
+@case("close 5000 objects")
+async def close_objects():
+    class Resource:
+        def close(self):
+            pass
+
+    services = Injector()
+    resources = [Resource() for _ in range(5000)]
+
+    async def op():
+        for resource in resources:
+            services.close.register(resource)
+        await services.close()
+        services.close.registry.clear()
+
+    return op
+
+
+async def noop():
+    async def op():
+        pass
+
+    return op
+
+
+async def allocated(op, samples=50):
+    tracemalloc.start()
+    try:
+        total = 0
+        for _ in range(samples):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            await op()
+            total += tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+    return total // samples
+
+
+async def measure(setup, duration=0.5, overhead=0):
+    op = await setup()
+    await op()
+    iterations, started_at = 0, perf_counter()
+    while perf_counter() - started_at < duration:
+        for _ in range(10):
+            await op()
+        iterations += 10
+    ops_per_sec = iterations / (perf_counter() - started_at)
+    bytes_per_op = max(0, await allocated(op) - overhead)
+    return {"ops_per_sec": round(ops_per_sec, 1), "bytes_per_op": bytes_per_op}
+
+
+async def run_all(names, duration):
+    overhead = await allocated(await noop())
+    results = {}
+    for name in names:
+        results[name] = await measure(CASES[name], duration, overhead)
+        print(
+            "%-28s %14.1f ops/sec %8d bytes/op"
+            % (name, results[name]["ops_per_sec"], results[name]["bytes_per_op"])
+        )
+    return results
+
+
+def import_time(samples=5):
+    """Best time of importing knighted in a fresh interpreter.
+    """
+    code = (
+        "import time; started_at = time.perf_counter(); import knighted; "
+        "print(time.perf_counter() - started_at)"
+    )
+    return min(
+        float(subprocess.check_output([sys.executable, "-c", code], cwd=here.parent))
+        for _ in range(samples)
+    )
+
+
+def regressions(results, baseline, speed_tolerance, memory_tolerance):
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result["ops_per_sec"] < expected["ops_per_sec"] * (1 - speed_tolerance):
+            yield "%s: %.1f ops/sec, baseline is %.1f" % (
+                name,
+                result["ops_per_sec"],
+                expected["ops_per_sec"],
+            )
+        allowed = expected["bytes_per_op"] * (1 + memory_tolerance) + 64
+        if result["bytes_per_op"] > allowed:
+            yield "%s: %d bytes/op, baseline is %d" % (
+                name,
+                result["bytes_per_op"],
+                expected["bytes_per_op"],
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("cases", nargs="*", help="cases to run, all by default")
+    parser.add_argument("--check", action="store_true", help="compare with baseline")
+    parser.add_argument("--update", action="store_true", help="store baseline")
+    parser.add_argument("--duration", type=float, default=0.5)
+    parser.add_argument("--speed-tolerance", type=float, default=0.5)
+    parser.add_argument("--memory-tolerance", type=float, default=0.1)
+    parser.add_argument("--import-budget", type=float, default=IMPORT_BUDGET)
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run_all(args.cases or list(CASES), args.duration))
+    imported = import_time()
+    print("%-28s %14.1f ms" % ("import knighted", imported * 1000))
+    if args.update:
+        baseline = json.loads(BASELINE.read_text()) if BASELINE.exists() else {}
+        baseline.update(results)
+        BASELINE.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+    if args.check:
+        baseline = json.loads(BASELINE.read_text())
+        failures = list(
+            regressions(results, baseline, args.speed_tolerance, args.memory_tolerance)
+        )
+        if imported > args.import_budget:
+            failures.append(
+                "import knighted: %.1f ms, budget is %.1f ms"
+                % (imported * 1000, args.import_budget * 1000)
+            )
+        for failure in failures:
+            print("REGRESSION", failure, file=sys.stderr)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
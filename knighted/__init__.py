@@ -4,12 +4,23 @@ from .bases import (
     attr,
     current_injector,
     AnnotationError,
+    CircularDependencyError,
+    BulkheadFullError,
+    ResolveTimeoutError,
+    ServiceFailedError,
     attr_lazy,
+    lazy,
+    resolve_lazy,
 )
-from ._version import get_versions
 
+__all__ = ["__version__", "Injector", "annotate", "attr", "current_injector"]
 
-__version__ = get_versions()["version"]
-del get_versions
 
-__all__ = ["__version__", "Injector", "annotate", "attr", "current_injector"]
+def __getattr__(name):
+    # versioneer may run git in a source checkout, only pay for it when asked
+    if name == "__version__":
+        from ._version import get_versions
+
+        version = globals()["__version__"] = get_versions()["version"]
+        return version
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
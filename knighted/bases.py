@@ -2,28 +2,77 @@ from __future__ import annotations
 
 import asyncio
 import concurrent.futures
+import gc
 import logging
+import os
 from abc import ABCMeta
-from collections import ChainMap
-from contextlib import contextmanager
+from collections import ChainMap, OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager, suppress
 from contextvars import ContextVar
-from functools import wraps
-from inspect import signature, unwrap
+from functools import partial, wraps
+from inspect import Parameter, isawaitable, signature, unwrap
 from itertools import chain
+from sys import maxsize
+from time import monotonic, perf_counter
 from types import MappingProxyType
-from typing import Callable, Optional, cast, Any
-from weakref import WeakKeyDictionary
-from dataclasses import Field, MISSING, dataclass, is_dataclass, fields
+from typing import Callable, Optional, Any
+from weakref import WeakKeyDictionary, WeakSet, WeakValueDictionary, finalize
+from dataclasses import dataclass, field, is_dataclass, fields
 
 from cached_property import cached_property
 
+from .hooks import EventLogger, Hooks, Timing
+from .metrics import Metrics
+
 logger = logging.getLogger("knighted")
 
+
+class IdentityMap:
+    """Values by object, like a WeakKeyDictionary, but matching objects by identity.
+
+    Objects equal to one another keep their own values, which are dropped
+    once their object is collected.
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self):
+        self.data: dict = {}
+
+    def get(self, obj, default=None):
+        entry = self.data.get(id(obj))
+        return default if entry is None else entry[0]
+
+    def __setitem__(self, obj, value):
+        """Raises TypeError if obj cannot be weakly referenced.
+        """
+        key = id(obj)
+        entry = self.data.get(key)
+        if entry is None:
+            dropping = finalize(obj, self.data.pop, key, None)
+            dropping.atexit = False
+        else:
+            dropping = entry[1]
+        self.data[key] = (value, dropping)
+
+    def __delitem__(self, obj):
+        _, dropping = self.data.pop(id(obj))
+        dropping.detach()
+
+
 MaybeInjector = Optional["Injector"]
 ANNOTATIONS: WeakKeyDictionary[Callable, "Annotation"] = WeakKeyDictionary()
-TAINTED: WeakKeyDictionary[Any, "Injector"] = WeakKeyDictionary()
+TAINTED: IdentityMap = IdentityMap()
+LAZY_ATTRS: WeakKeyDictionary[type, dict] = WeakKeyDictionary()
+#: injectors by class, their resolvers are stale once the class registers a factory
+INJECTORS: WeakKeyDictionary[type, WeakSet] = WeakKeyDictionary()
 Missing = object()
 current_injector_var: ContextVar[MaybeInjector] = ContextVar("current_injector")
+#: injectors reset in processes forked after their prefork()
+PREFORKED: WeakSet = WeakSet()
+deadline_var: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+#: services whose factories are running, in the task loading a dependency
+resolving_var: ContextVar[tuple] = ContextVar("resolving", default=())
 
 
 def current_injector() -> MaybeInjector:
@@ -35,6 +84,39 @@ class AnnotationError(Exception):
     ...
 
 
+class CircularDependencyError(Exception):
+    ...
+
+
+class ResolveTimeoutError(asyncio.TimeoutError):
+    """Raised when a service is not resolved in time.
+
+    path is the chain of pending services that service was waiting for,
+    the last one is the service that blew the budget.
+    """
+
+    def __init__(self, service: str, path: list, timeout: float):
+        super().__init__(
+            "Service %r not resolved within %.3fs, waiting for %s"
+            % (service, timeout, " -> ".join(map(repr, path)))
+        )
+        self.service = service
+        self.path = path
+        self.timeout = timeout
+
+
+class BulkheadFullError(Exception):
+    """Raised when a factory runs at its concurrency limit and its queue is full.
+    """
+
+
+class ServiceFailedError(Exception):
+    """Raised while the factory of a service backs off after failures.
+
+    The last failure is the cause of the error.
+    """
+
+
 def annotate(*pos_notes, **kw_notes):
     def wrapper(func):
         func = unwrap(func)
@@ -59,15 +141,107 @@ def annotate(*pos_notes, **kw_notes):
 KNIGHTED_NAMESPACE = "knighted"
 
 
+class lazy(str):
+    """Marks a service that is injected as an awaitable handle.
+
+    The service is loaded only if the handle is awaited::
+
+        @annotate(reporter=lazy("reporter"))
+        async def handle(request, reporter):
+            ...
+            await (await reporter).report(error)
+    """
+
+    __slots__ = ()
+
+
+class LazyService:
+    """Awaitable handle of a service, which is loaded on first await.
+    """
+
+    __slots__ = ("injector", "name", "future")
+
+    def __init__(self, injector: Injector, name: str):
+        self.injector = injector
+        self.name = name
+        self.future: Optional[asyncio.Future] = None
+
+    def __await__(self):
+        if self.future is None:
+            self.future = self.injector.get(self.name)
+        return self.future.__await__()
+
+    def release(self):
+        """Gives back the instance of a pooled service, once loaded by an await.
+        """
+        if self.future is None:
+            return
+        if self.future.done():
+            self.released(self.future)
+        else:
+            self.future.add_done_callback(self.released)
+
+    def released(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is None:
+            self.injector.release(self.name, future.result())
+
+    def __repr__(self):
+        return "<LazyService %r>" % self.name
+
+
 class Annotation:
+    """Injection plan of an annotated callable.
+
+    The signature is inspected once, so that finding which markers are
+    missing from a call only takes tuple and set operations.
+    """
+
     def __init__(self, func, pos_notes, kw_notes):
-        self.bind_partial = signature(func).bind_partial
+        sig = signature(func)
+        self.bind_partial = sig.bind_partial
         self.is_coro = asyncio.iscoroutinefunction(func)
         self.markers = self.bind_partial(*pos_notes, **kw_notes).arguments
+        positionals = [
+            param.name
+            for param in sig.parameters.values()
+            if param.kind in (Parameter.POSITIONAL_ONLY, Parameter.POSITIONAL_OR_KEYWORD)
+        ]
+        self.positions = {name: i for i, name in enumerate(positionals)}
+        self.keywords = frozenset(
+            param.name
+            for param in sig.parameters.values()
+            if param.kind in (Parameter.POSITIONAL_OR_KEYWORD, Parameter.KEYWORD_ONLY)
+        )
+        self.plan = tuple(
+            (key, service, self.positions.get(key, maxsize))
+            for key, service in self.markers.items()
+        )
+        self.unbound = tuple((key, service) for key, service, _ in self.plan)
+        self.lazy = any(isinstance(service, lazy) for service in self.markers.values())
+        # markers that cannot be injected by keyword need the full binding
+        self.plain = self.keywords.issuperset(self.markers)
+        self.max_args = len(positionals)
 
     def given(self, *args, **kwargs):
         return list(self.bind_partial(*args, **kwargs).arguments)
 
+    def missing(self, args, kwargs):
+        """Returns the (key, service) markers that are not filled by the call.
+        """
+        nargs = len(args)
+        if not self.plain or nargs > self.max_args:
+            given = self.given(*args, **kwargs)
+            return [(key, service) for key, service in self.unbound if key not in given]
+        if not kwargs:
+            if not nargs:
+                return self.unbound
+            return [(key, service) for key, service, i in self.plan if i >= nargs]
+        return [
+            (key, service)
+            for key, service, i in self.plan
+            if i >= nargs and key not in kwargs
+        ]
+
 
 class DataProxy:
     def __init__(self):
@@ -78,19 +252,151 @@ class DataProxy:
 
     def __get__(self, instance, owner):
         if instance is None:
-            response = self.data.setdefault(owner, {})
-        else:
-            response = self.data.setdefault(
-                instance, ChainMap({}, MappingProxyType(getattr(owner, self.name)))
-            )
+            return self.data.setdefault(owner, {})
+        # shadows the descriptor, next lookups are plain attribute accesses
+        response = instance.__dict__[self.name] = ChainMap(
+            {}, MappingProxyType(getattr(owner, self.name))
+        )
         return response
 
 
+class Factory:
+    """Registered factory of a service.
+
+    Factories annotated with ``annotate`` declare the services they depend
+    on, which are loaded before calling them.
+    """
+
+    #: auto inlined factories must run faster than this, in seconds
+    auto_inline_below = 0.0005
+    #: auto inlined factories must be measured this number of times
+    auto_inline_runs = 3
+
+    def __init__(
+        self,
+        func,
+        *,
+        name=None,
+        singleton=True,
+        executor=None,
+        inline=False,
+        maxsize=None,
+        ttl=None,
+        weak=False,
+        pool=None,
+        pool_min=0,
+        idle_timeout=None,
+        acquire_timeout=None,
+        batch=False,
+        batch_window=None,
+        scoped=False,
+        negative_ttl=None,
+        negative_max_ttl=60.0,
+        max_concurrency=None,
+        queue_limit=None,
+        refresh_every=None,
+        close_stale=False,
+        fork_safe=False,
+        persist=False,
+        key=None,
+    ):
+        self.func = func
+        self.name = name
+        self.singleton = singleton and not pool
+        self.scoped = scoped
+        self.negative_ttl = negative_ttl
+        self.negative_max_ttl = negative_max_ttl
+        self.max_concurrency = max_concurrency
+        self.queue_limit = queue_limit
+        self.refresh_every = refresh_every
+        self.close_stale = close_stale
+        self.fork_safe = fork_safe
+        if persist and key is None:
+            raise ValueError("Persisted factory %r needs a key" % name)
+        if batch and (pool or persist):
+            raise ValueError("Batch factory %r cannot be pooled or persisted" % name)
+        if pool and (maxsize or ttl or weak or persist or refresh_every):
+            raise ValueError(
+                "Pooled factory %r cannot be cached, persisted or refreshed" % name
+            )
+        if refresh_every and not singleton:
+            raise ValueError("Refreshed factory %r must be a singleton" % name)
+        self.persist = persist
+        self.key = key
+        self.pool = pool
+        self.pool_min = pool_min
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.weak = weak
+        self.batch = batch
+        self.batch_window = batch_window
+        self.bounded = self.singleton and bool(maxsize or ttl or weak)
+        self.executor = executor
+        self.inline = inline
+        self.inlined = inline is True
+        self.fast_runs = 0
+        self.is_coro = asyncio.iscoroutinefunction(func)
+        self.annotation = ANNOTATIONS.get(unwrap(func))
+
+    def stats_key(self, name: str) -> str:
+        # services of bounded and pooled factories are counted together
+        return self.name if self.bounded or self.pool else name
+
+    def measured(self, func, *args):
+        """Calls func, and decides if next calls of an auto factory run inline.
+
+        Factories are inlined after a few fast runs, and are never inlined
+        again once a run is slower.
+        """
+        started_at = perf_counter()
+        try:
+            return func(*args)
+        finally:
+            if perf_counter() - started_at > self.auto_inline_below:
+                self.inline = self.inlined = False
+            else:
+                self.fast_runs += 1
+                self.inlined = self.fast_runs >= self.auto_inline_runs
+
+    def dependencies(self, args) -> tuple:
+        """Returns the (key, service) markers that args do not fill.
+
+        Lazy markers are left out, they are not loaded before the call.
+        """
+        if self.annotation is None:
+            return ()
+        markers = self.annotation.missing(args, {})
+        if self.annotation.lazy:
+            return tuple(marker for marker in markers if not isinstance(marker[1], lazy))
+        return tuple(markers)
+
+    def fingerprint(self, args) -> str:
+        """Returns the fingerprint of the snapshot of the service of args.
+
+        key is either a string, or a callable that returns one from args.
+        """
+        return self.key(*args) if callable(self.key) else str(self.key)
+
+    def backoff(self, failures: int) -> float:
+        """Returns the seconds a service is not loaded again after failures.
+        """
+        return min(self.negative_ttl * 2 ** (failures - 1), self.negative_max_ttl)
+
+
 class FactoryAccessor:
     def __get__(self, instance, owner):
-        def wrap_name(name, func=None, *, singleton=True):
+        def wrap_name(name, func=None, *, singleton=True, **options):
             def wrap_func(func):
-                (instance or owner).factories[name] = func, singleton
+                (instance or owner).factories[name] = Factory(
+                    func, name=name, singleton=singleton, **options
+                )
+                if instance is not None:
+                    instance.invalidate()
+                else:
+                    for injector in list(INJECTORS.get(owner, ())):
+                        injector.invalidate()
                 return func
 
             if func:
@@ -100,8 +406,533 @@ class FactoryAccessor:
         return wrap_name
 
 
+class TrackedExecutor:
+    """Runs sync factories, and tracks how deep its queue gets.
+
+    An executor of None runs factories inline, on the event loop, and warns
+    when one of them blocks the loop for longer than threshold seconds.
+    """
+
+    def __init__(
+        self,
+        executor: Optional[concurrent.futures.Executor] = None,
+        *,
+        threshold: float = 0.01,
+    ):
+        self.executor = executor
+        self.threshold = threshold
+        self.max_workers = getattr(executor, "_max_workers", 1) if executor else 0
+        self.submitted = 0
+        self.in_flight = 0
+        self.peak_queued = 0
+
+    @property
+    def queued(self) -> int:
+        return max(0, self.in_flight - self.max_workers)
+
+    def run(self, func, *args, timing: Optional[Timing] = None) -> asyncio.Future:
+        self.submitted += 1
+        if self.executor is None:
+            future = asyncio.get_running_loop().create_future()
+            if timing is not None:
+                timing.start()
+            started_at = perf_counter()
+            try:
+                future.set_result(func(*args))
+            except Exception as error:
+                future.set_exception(error)
+            elapsed = perf_counter() - started_at
+            if elapsed > self.threshold:
+                logger.warning("Inline call %r blocked the loop for %.3fs", func, elapsed)
+            return future
+        self.in_flight += 1
+        self.peak_queued = max(self.peak_queued, self.queued)
+        if timing is not None and isinstance(
+            self.executor, concurrent.futures.ThreadPoolExecutor
+        ):
+            func = partial(marked, timing.start, func)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, func, *args)
+        future.add_done_callback(self.done)
+        return future
+
+    def done(self, future):
+        self.in_flight -= 1
+
+    def respawn(self) -> TrackedExecutor:
+        """Returns a tracker of a new executor like this one.
+
+        Workers of thread and process pools do not survive a fork.
+        """
+        executor = self.executor
+        if isinstance(executor, concurrent.futures.ThreadPoolExecutor):
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix=executor._thread_name_prefix,
+            )
+        elif isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=executor._mp_context
+            )
+        return TrackedExecutor(executor, threshold=self.threshold)
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "submitted": self.submitted,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "peak_queued": self.peak_queued,
+        }
+
+
+class ServiceCache:
+    """Services of a factory, kept with a bounded policy.
+
+    Services are evicted when the cache holds more than maxsize of them,
+    least recently used first, or ttl seconds after they were loaded.
+    With a ttl, the oldest ones are evicted first instead.
+    Weak caches do not keep their services alive, and cannot hold services
+    that are not weakly referenceable, such as dicts, lists or strings.
+    """
+
+    def __init__(self, maxsize=None, ttl=None, weak=False, *, name=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = WeakValueDictionary() if weak else {}
+        self.order: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.warned = False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name: str) -> bool:
+        if name not in self.entries:
+            return False
+        return self.ttl is None or self.order[name] > monotonic()
+
+    def __getitem__(self, name: str):
+        try:
+            value = self.entries[name]
+        except KeyError:
+            # weak service has been collected
+            self.order.pop(name, None)
+            raise
+        if self.ttl is None:
+            self.order.move_to_end(name)
+        elif self.order[name] <= monotonic():
+            self.evict(name)
+            raise KeyError(name)
+        self.hits += 1
+        return value
+
+    def __setitem__(self, name: str, value):
+        try:
+            self.entries[name] = value
+        except TypeError:
+            if not self.warned:
+                self.warned = True
+                logger.warning(
+                    "Weak cache %r cannot hold %s services, they are loaded on every get()",
+                    self.name,
+                    type(value).__name__,
+                )
+            return
+        if self.ttl is None:
+            self.order[name] = None
+        else:
+            self.purge()
+            self.order[name] = monotonic() + self.ttl
+        self.order.move_to_end(name)
+        if len(self.order) > 2 * len(self.entries):
+            for key in [key for key in self.order if key not in self.entries]:
+                del self.order[key]
+        while self.maxsize and len(self.order) > self.maxsize:
+            self.evict(next(iter(self.order)))
+
+    def purge(self):
+        """Evicts expired services.
+
+        Services expire in the order they were stored, hits do not reorder
+        caches with a ttl.
+        """
+        now = monotonic()
+        while self.order:
+            name, expires_at = next(iter(self.order.items()))
+            if expires_at > now:
+                break
+            self.evict(name)
+
+    def evict(self, name: str):
+        if self.pop(name, Missing) is not Missing:
+            self.evictions += 1
+
+    def pop(self, name: str, default=None):
+        self.order.pop(name, None)
+        return self.entries.pop(name, default)
+
+    def clear(self):
+        self.entries.clear()
+        self.order.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class ServicePool:
+    """Instances of a pooled factory, each one lent to one caller at a time.
+
+    The pool creates up to maxsize instances, callers wait for a released
+    one afterwards. Instances idle for longer than idle_timeout seconds are
+    closed, but the pool keeps at least minsize of them.
+    """
+
+    def __init__(
+        self, create, maxsize, *, minsize=0, idle_timeout=None, acquire_timeout=None
+    ):
+        self.create = create
+        self.maxsize = maxsize
+        self.minsize = minsize
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.idle: deque = deque()
+        self.waiters: deque = deque()
+        self.borrowed: set = set()
+        self.size = 0
+        self.filled = False
+        self.filling: Optional[asyncio.Future] = None
+        self.closed = False
+
+    async def fill(self):
+        missing = self.minsize - self.size
+        if missing > 0:
+            self.size += missing
+            try:
+                instances = await asyncio.gather(*(self.create() for _ in range(missing)))
+            except BaseException:
+                self.size -= missing
+                self.filling = None
+                raise
+            now = monotonic()
+            self.idle.extend((instance, now) for instance in instances)
+        self.filled = True
+
+    async def acquire(self):
+        instance = await self.take()
+        self.borrowed.add(id(instance))
+        return instance
+
+    async def take(self):
+        if self.closed:
+            raise RuntimeError("Pool is closed")
+        if not self.filled:
+            if self.filling is None:
+                self.filling = asyncio.ensure_future(self.fill())
+            await asyncio.shield(self.filling)
+        self.prune()
+        if self.idle:
+            instance, _ = self.idle.pop()
+            return instance
+        if self.size < self.maxsize:
+            self.size += 1
+            try:
+                return await self.create()
+            except BaseException:
+                self.size -= 1
+                raise
+        return await self.wait()
+
+    async def wait(self):
+        """Waits for an instance to be released.
+        """
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, self.acquire_timeout)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the instance was handed over already
+                self.release(waiter.result())
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    def release(self, instance):
+        self.borrowed.discard(id(instance))
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.borrowed.add(id(instance))
+                waiter.set_result(instance)
+                return
+        if self.closed:
+            self.discard(instance)
+        else:
+            self.idle.append((instance, monotonic()))
+
+    def prune(self):
+        if self.idle_timeout is None:
+            return
+        expired = monotonic() - self.idle_timeout
+        while self.idle and self.idle[0][1] < expired and self.size > self.minsize:
+            instance, _ = self.idle.popleft()
+            self.discard(instance)
+
+    def discard(self, instance) -> Optional[asyncio.Future]:
+        self.size -= 1
+        close = getattr(instance, "close", None)
+        if close is not None:
+            result = close()
+            if isawaitable(result):
+                return asyncio.ensure_future(result)
+        return None
+
+    def close(self) -> Optional[asyncio.Future]:
+        """Closes idle instances now, and borrowed ones once released.
+        """
+        self.closed = True
+        closing = []
+        while self.idle:
+            instance, _ = self.idle.popleft()
+            result = self.discard(instance)
+            if result is not None:
+                closing.append(result)
+        return asyncio.gather(*closing) if closing else None
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "idle": len(self.idle),
+            "borrowed": len(self.borrowed),
+            "waiting": len(self.waiters),
+        }
+
+
+class Bulkhead:
+    """Limits how many calls of a factory run at once.
+
+    Calls above limit wait in a queue of queue_limit calls at most, further
+    calls fail with BulkheadFullError. A queue_limit of None never rejects.
+    """
+
+    def __init__(self, limit: int, queue_limit: Optional[int] = None, *, name=None):
+        self.limit = limit
+        self.queue_limit = queue_limit
+        self.name = name
+        self.active = 0
+        self.waiters: deque = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.peak_queued = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+
+    async def acquire(self):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if self.queue_limit is not None and len(self.waiters) >= self.queue_limit:
+            self.rejected += 1
+            raise BulkheadFullError(
+                "Factory %r runs %d calls and queues %d"
+                % (self.name, self.active, len(self.waiters))
+            )
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.peak_queued = max(self.peak_queued, len(self.waiters))
+        started_at = monotonic()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over already
+                self.release()
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            waited = monotonic() - started_at
+            self.wait_sum += waited
+            self.wait_max = max(self.wait_max, waited)
+        self.admitted += 1
+
+    def release(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": len(self.waiters),
+            "peak_queued": self.peak_queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_sum": self.wait_sum,
+            "wait_max": self.wait_max,
+        }
+
+
+class RefreshScheduler:
+    """Refreshes services periodically, from one task shared by every service.
+    """
+
+    def __init__(self, refresh):
+        self.refresh = refresh
+        self.due: dict = {}
+        self.task: Optional[asyncio.Task] = None
+        self.wakeup: Optional[asyncio.Future] = None
+
+    def add(self, name: str, every: float):
+        if name in self.due:
+            return
+        loop = asyncio.get_running_loop()
+        self.due[name] = (loop.time() + every, every)
+        if self.task is None:
+            self.task = loop.create_task(self.run())
+        elif self.wakeup is not None and not self.wakeup.done():
+            self.wakeup.set_result(None)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self.due:
+                now = loop.time()
+                for name, (when, every) in list(self.due.items()):
+                    if when <= now:
+                        self.due[name] = (now + every, every)
+                        self.refresh(name)
+                if not self.due:
+                    break
+                delay = min(when for when, _ in self.due.values()) - loop.time()
+                self.wakeup = loop.create_future()
+                await asyncio.wait((self.wakeup,), timeout=max(delay, 0))
+        finally:
+            self.task = self.wakeup = None
+
+    def discard(self, name: str):
+        self.due.pop(name, None)
+
+    def cancel(self):
+        self.due.clear()
+        if self.task is not None:
+            self.task.cancel()
+
+
+class BatchLoader:
+    """Collects the keys of a batch factory requested within one window.
+
+    Keys requested within one event loop tick, or within window seconds,
+    are loaded by one call that returns a mapping of keys to services.
+    """
+
+    def __init__(self, load, *, name=None, window=None):
+        self.load = load
+        self.name = name
+        self.window = window
+        self.waiting: dict = {}
+        self.handle: Optional[asyncio.Handle] = None
+        self.batches = 0
+        self.keys = 0
+
+    def add(self, key: str) -> asyncio.Future:
+        try:
+            return self.waiting[key]
+        except KeyError:
+            pass
+        loop = asyncio.get_running_loop()
+        future = self.waiting[key] = loop.create_future()
+        if self.handle is None:
+            if self.window:
+                self.handle = loop.call_later(self.window, self.dispatch)
+            else:
+                self.handle = loop.call_soon(self.dispatch)
+        return future
+
+    def dispatch(self):
+        waiting, self.waiting, self.handle = self.waiting, {}, None
+        self.batches += 1
+        self.keys += len(waiting)
+        task = asyncio.ensure_future(self.load(list(waiting)))
+        task.add_done_callback(partial(self.fan_out, waiting))
+
+    def fan_out(self, waiting: dict, task: asyncio.Future):
+        if task.cancelled():
+            for future in waiting.values():
+                future.cancel()
+            return
+        error = task.exception()
+        results = task.result() if error is None else {}
+        for key, future in waiting.items():
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            elif key in results:
+                future.set_result(results[key])
+            else:
+                future.set_exception(
+                    KeyError("Batch %r returned no result for %r" % (self.name, key))
+                )
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "keys": self.keys, "waiting": len(self.waiting)}
+
+
+def forward(future: asyncio.Future, task: asyncio.Future):
+    """Resolves future like task.
+    """
+    if future.done():
+        return
+    if task.cancelled():
+        future.cancel()
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
+
+
+def marked(mark, func, *args):
+    mark()
+    return func(*args)
+
+
 def close_reaction(obj):
-    obj.close()
+    return obj.close()
+
+
+@dataclass
+class CloseReport:
+    """Outcome of closing an injector.
+    """
+
+    closed: list = field(default_factory=list)
+    #: objects that were still closing at the deadline
+    missed: list = field(default_factory=list)
+    #: (object, exception) pairs
+    failed: list = field(default_factory=list)
 
 
 class CloseHandler:
@@ -130,59 +961,1095 @@ class CloseHandler:
         else:
             self.registry.pop(obj, None)
 
-    def __call__(self):
-        for obj, reactions in self.registry.items():
-            for reaction in reactions:
-                reaction(obj)
+    def __call__(self, timeout: Optional[float] = None):
+        """Forgets every service, and closes registered objects.
+
+        Objects are closed dependents first, objects of the same level are
+        closed concurrently. Reactions may return awaitables.
+        Within a running loop, reactions are called right away until one of
+        them returns an awaitable, and the returned future resolves to a
+        CloseReport once every object is closed or after timeout seconds.
+        """
+        waves = self.waves()
+        self.forget()
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.shutdown(waves, timeout))
+        report = CloseReport()
+        tasks: dict = {}
+        while waves and not tasks:
+            tasks = self.begin(waves.pop(0), report)
+        return asyncio.ensure_future(self.shutdown(waves, timeout, report, tasks))
+
+    def forget(self):
+        for task in self.injector.pending.values():
+            # loads of a finished loop are done, or cannot be cancelled
+            if not task.get_loop().is_closed():
+                task.cancel()
+        self.injector.pending.clear()
+        self.injector.waiters.clear()
+        if self.injector.scheduler is not None:
+            self.injector.scheduler.cancel()
+        for task in self.injector.refreshing.values():
+            task.cancel()
+        self.injector.refreshing.clear()
         self.injector.services.clear()
+        self.injector.dependencies.clear()
+        self.injector.draining.extend(
+            pool for pool in self.injector.pools.values() if pool.borrowed
+        )
+        self.injector.pools.clear()
+        self.injector.failures.clear()
+        for cache in self.injector.caches.values():
+            cache.clear()
+
+    def retire(self, obj) -> Optional[asyncio.Future]:
+        """Closes obj with its registered reactions, while the injector stays open.
+        """
+        try:
+            reactions = self.registry.pop(obj, None)
+        except TypeError:
+            # obj cannot be weakly referenced, so it was never registered
+            return None
+        if not reactions:
+            return None
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.react(obj, list(reactions)))
+        task = asyncio.ensure_future(self.react(obj, list(reactions)))
+        task.add_done_callback(partial(self.retired, obj))
+        return task
+
+    def retired(self, obj, task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Failed to close %r", obj, exc_info=task.exception())
+
+    def waves(self) -> list:
+        """Groups registered objects by their rank in the dependency graph.
+
+        Objects of loaded services that no other service depends on are in
+        the first wave, their dependencies in the next ones.
+        """
+        injector = self.injector
+        names: dict = {}
+        services = injector.services.maps[0] if injector.parent else injector.services
+        for name, obj in chain(services.items(), injector.pools.items()):
+            names.setdefault(id(obj), []).append(name)
+        dependents: dict = {}
+        for name, deps in injector.dependencies.items():
+            for dep in deps:
+                dependents.setdefault(dep, []).append(name)
+        ranks: dict = {}
+
+        def rank(name):
+            if name not in ranks:
+                ranks[name] = 0  # breaks cycles
+                ranks[name] = max(
+                    (rank(dependent) + 1 for dependent in dependents.get(name, ())),
+                    default=0,
+                )
+            return ranks[name]
+
+        waves: dict = {}
+        for obj, reactions in list(self.registry.items()):
+            level = max(map(rank, names.get(id(obj), ())), default=0)
+            waves.setdefault(level, []).append((obj, list(reactions)))
+        return [waves[level] for level in sorted(waves)]
+
+    async def shutdown(
+        self,
+        waves,
+        timeout: Optional[float] = None,
+        report: Optional[CloseReport] = None,
+        tasks: Optional[dict] = None,
+    ) -> CloseReport:
+        """Closes objects wave after wave, tasks are the ones of a wave already begun.
+        """
+        report = CloseReport() if report is None else report
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        waves = iter(waves)
+        while True:
+            if tasks:
+                await self.settle(tasks, deadline, report)
+            wave = next(waves, None)
+            if wave is None:
+                break
+            tasks = self.begin(wave, report)
+        if report.missed:
+            logger.warning("Objects not closed before deadline: %r", report.missed)
+        for callback in self.injector.hooks.on_close:
+            callback(report)
+        return report
+
+    def begin(self, wave, report: CloseReport) -> dict:
+        """Calls the reactions of wave, returns tasks of the awaitables they returned.
+        """
+        tasks = {}
+        for obj, reactions in wave:
+            awaitables = []
+            try:
+                for reaction in reactions:
+                    result = reaction(obj)
+                    if isawaitable(result):
+                        awaitables.append(result)
+            except Exception as error:
+                report.failed.append((obj, error))
+                continue
+            if awaitables:
+                tasks[asyncio.ensure_future(self.finish(awaitables))] = obj
+            else:
+                report.closed.append(obj)
+        return tasks
+
+    async def finish(self, awaitables):
+        for awaitable in awaitables:
+            await awaitable
+
+    async def settle(self, tasks: dict, deadline: Optional[float], report: CloseReport):
+        remaining = None
+        if deadline is not None:
+            remaining = max(0, deadline - asyncio.get_running_loop().time())
+        done, pending = await asyncio.wait(tasks, timeout=remaining)
+        for task in done:
+            if task.exception():
+                report.failed.append((tasks[task], task.exception()))
+            else:
+                report.closed.append(tasks[task])
+        for task in pending:
+            task.cancel()
+            report.missed.append(tasks[task])
+
+    async def react(self, obj, reactions):
+        for reaction in reactions:
+            result = reaction(obj)
+            if isawaitable(result):
+                await result
+
+
+class Resolver:
+    """Resolves service names to their factory.
+
+    Factories are indexed by a prefix trie of their name segments, so that
+    the longest registered prefix of a name is found in one walk.
+    Resolutions are memoized until a new factory is registered, which
+    marks the resolver stale.
+    """
+
+    max_size = 4096
+
+    def __init__(self, factories):
+        self.factories = factories
+        self.trie: dict = {}
+        self.cache: dict = {}
+        self.stale = True
+
+    def build(self):
+        self.trie.clear()
+        self.cache.clear()
+        for fact in self.factories:
+            node = self.trie
+            for part in fact.split(":"):
+                node = node.setdefault(part, {})
+            node[Missing] = fact
+        self.stale = False
+
+    def __call__(self, name: str):
+        """Returns the factory that provides name, and its arguments.
+        """
+        if self.stale:
+            self.build()
+        try:
+            return self.cache[name]
+        except KeyError:
+            pass
+        parts = name.split(":")
+        node, fact, depth = self.trie, None, 0
+        for i, part in enumerate(parts):
+            node = node.get(part)
+            if node is None:
+                break
+            if Missing in node:
+                fact, depth = node[Missing], i + 1
+        if fact is None:
+            raise ValueError("%r is not defined" % name)
+        if len(self.cache) >= self.max_size:
+            self.cache.clear()
+        resolution = self.cache[name] = self.factories[fact], tuple(parts[depth:])
+        return resolution
 
 
 class Injector(metaclass=ABCMeta):
     factory = FactoryAccessor()
     factories = DataProxy()
     services = DataProxy()
+    parent: MaybeInjector = None
+    #: services kept by forked children, set by prefork()
+    fork_safe: frozenset = frozenset()
+    #: scopes with their own resolver, layered over the factories of self
+    layered: Any = ()
 
     def __init__(self):
+        self.setup()
+
+    def setup(self, parent: MaybeInjector = None):
+        """Initializes the state of the injector, or of a scope of parent.
+
+        Scopes share the resolver, executors, hooks and bulkheads of their
+        parent, and own everything else. Subclasses keeping state of their
+        own extend it, scope() calls it instead of __init__.
+        """
         self.close = CloseHandler(self)
+        self.pending = {}
+        self.refreshing = {}
+        self.scheduler = None
+        self.waiters = {}
+        self.failures = {}
+        self.caches = {}
+        self.pools = {}
+        self.batches = {}
+        self.draining = []
+        self.dependencies = {}
+        if parent is not None:
+            self.parent = parent
+            self.services = parent.services.new_child()
+            self.factories = parent.factories.new_child()
+            self.resolve = parent.resolve
+            self.executors = parent.executors
+            self.hooks = parent.hooks
+            self.metrics = parent.metrics
+            self.bulkheads = parent.bulkheads
+            return
+        self.hooks = Hooks()
+        self.metrics = self.hooks.subscribe(Metrics()) if self.track_stats else None
+        if self.log_events:
+            self.hooks.subscribe(EventLogger())
+        self.resolve = Resolver(self.factories)
+        self.bulkheads = {}
+        try:
+            INJECTORS[type(self)].add(self)
+        except KeyError:
+            INJECTORS[type(self)] = WeakSet([self])
+
+    def invalidate(self):
+        """Drops the resolutions of self, and of its scopes, once a factory is registered.
+        """
+        if self.parent is not None and self.resolve is self.parent.resolve:
+            # scopes share the resolver of their parent until they register
+            # their own factories
+            self.resolve = Resolver(self.factories)
+            injector = self.parent
+            while injector is not None:
+                if not injector.layered:
+                    injector.layered = WeakSet()
+                injector.layered.add(self)
+                injector = injector.parent
+        self.resolve.stale = True
+        for scope in self.layered:
+            scope.resolve.stale = True
+
+    def scope(self) -> Injector:
+        """Returns a child injector, layered over the services and factories of self.
+
+        Values set in the scope and services of ``scoped=True`` factories
+        stay in the scope, other services are loaded by the parent and shared.
+        Nothing is copied, and setup() initializes the scope instead of __init__.
+        Closing the scope closes only what was registered to it.
+        """
+        cls = type(self)
+        child = cls.__new__(cls)
+        child.setup(self)
+        return child
 
-    def refresh(self, name: str):
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def refresh(self, name: str, *, background=False, close=False):
+        """Forgets service, so that the next get() loads it again.
+
+        It returns the forgotten service, or with background, a future of
+        the new one. The current service is served until the new one is
+        loaded, then they are swapped. Concurrent background refreshes of a
+        service share one load.
+        With close, the replaced service is closed by its registered reactions.
+        """
+        if self.parent is not None and name not in self.services.maps[0]:
+            return self.parent.refresh(name, background=background, close=close)
+        if background:
+            return self.revalidate(name, close)
+        if self.scheduler is not None:
+            self.scheduler.discard(name)
         service = self.services.pop(name, None)
+        self.failures.pop(name, None)
+        cache = self.cache_of(name)
+        if cache is not None:
+            service = cache.pop(name, service)
         if service:
             logger.info("Refreshed service=%s", name)
+            if close:
+                self.close.retire(service)
         return service
 
+    def revalidate(self, name: str, close: bool) -> asyncio.Future:
+        factory, args = self.resolve(name)
+        if not factory.singleton:
+            raise ValueError("%r is not a singleton" % name)
+        task = self.refreshing.get(name)
+        if task is not None:
+            return task
+        cache = self.cache_of(name)
+        entries = cache.entries if cache is not None else self.services
+        current = entries.get(name, Missing)
+        if current is Missing:
+            return self.get(name)
+        task = self.refreshing[name] = self.call(factory, args, name, factory.stats_key(name))
+        task.add_done_callback(partial(self.revalidated, name, factory, current, close))
+        return task
+
+    def revalidated(self, name: str, factory: Factory, current, close: bool, task):
+        if self.refreshing.get(name) is task:
+            del self.refreshing[name]
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logger.warning(
+                "Failed to refresh service=%s, still serving the current one",
+                name,
+                exc_info=task.exception(),
+            )
+            return
+        if factory.bounded:
+            self.cache_for(factory)[name] = task.result()
+        else:
+            self.services[name] = task.result()
+        logger.info("Refreshed service=%s", name)
+        if close and task.result() is not current:
+            self.close.retire(current)
+
+    def schedule(self, name: str, every: float):
+        """Refreshes service in background every few seconds, while it is loaded.
+        """
+        if self.scheduler is None:
+            self.scheduler = RefreshScheduler(self.scheduled)
+        self.scheduler.add(name, every)
+
+    def scheduled(self, name: str):
+        cache = self.cache_of(name)
+        if name not in (cache if cache is not None else self.services):
+            # evicted or forgotten, it is scheduled again once loaded
+            self.scheduler.discard(name)
+            return
+        factory, _ = self.resolve(name)
+        future = self.refresh(name, background=True, close=factory.close_stale)
+        # failures are logged, not raised
+        future.add_done_callback(lambda x: x.cancelled() or x.exception())
+
+    #: collects the metrics returned by stats(), at the cost of a callback per get()
+    track_stats = False
+    #: logs resolutions, applications and closing
+    log_events = False
+    #: size of the default thread pool
+    max_workers = 10
+    #: executor of sync factories that do not choose one
+    default_executor = "default"
+    #: inline factories that block the loop longer than this are reported
+    inline_threshold = 0.01
+    #: directory of the snapshots of persisted factories
+    persist_dir = os.path.join(os.environ.get("XDG_CACHE_HOME", "~/.cache"), "knighted")
+    #: size of the snapshots kept in persist_dir, in bytes
+    persist_max_bytes = 512 * 2 ** 20
+
+    @cached_property
+    def store(self):
+        # imported on demand, it costs much to every import of knighted
+        from .persist import SnapshotStore
+
+        return SnapshotStore(self.persist_dir, self.persist_max_bytes)
+
     @cached_property
     def executor(self):
-        return concurrent.futures.ThreadPoolExecutor(max_workers=10)
+        return concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
 
-    def get(self, name: str) -> asyncio.Future:
-        future: asyncio.Future = asyncio.Future()
+    @cached_property
+    def executors(self) -> dict:
+        return {
+            "default": TrackedExecutor(self.executor),
+            "inline": TrackedExecutor(None, threshold=self.inline_threshold),
+        }
+
+    def add_executor(self, name: str, executor: Optional[concurrent.futures.Executor]):
+        """Registers executor under name, None runs factories inline.
+
+        Factories run by a ProcessPoolExecutor must be picklable, and so must
+        their results.
+        """
+        self.executors[name] = TrackedExecutor(executor, threshold=self.inline_threshold)
+
+    def executor_for(self, factory: Factory) -> TrackedExecutor:
+        if factory.inlined:
+            return self.executors["inline"]
+        key = factory.executor or self.default_executor
+        try:
+            return self.executors[key]
+        except KeyError:
+            if isinstance(key, str):
+                raise ValueError("Executor %r is not defined" % key)
+        tracked = self.executors[key] = TrackedExecutor(
+            key, threshold=self.inline_threshold
+        )
+        return tracked
+
+    def run_sync(
+        self, factory: Factory, args, kwargs=None, timing: Optional[Timing] = None
+    ) -> asyncio.Future:
+        func = factory.func
+        if kwargs:
+            func = partial(func, **kwargs)
+        if factory.inline == "auto":
+            func = partial(factory.measured, func)
+        return self.executor_for(factory).run(func, *args, timing=timing)
+
+    def stats(self) -> dict:
+        """Returns a snapshot of the metrics of services, executors and the like.
+
+        It can be rendered with knighted.metrics.render_prometheus().
+        """
+        return {
+            "services": self.metrics.snapshot() if self.metrics else {},
+            "executors": self.executor_stats(),
+            "caches": self.cache_stats(),
+            "pools": self.pool_stats(),
+            "batches": self.batch_stats(),
+            "bulkheads": self.bulkhead_stats(),
+        }
+
+    def executor_stats(self) -> dict:
+        """Returns the queue metrics of every executor.
+        """
+        return {
+            str(name): tracked.stats() for name, tracked in self.executors.items()
+        }
+
+    def cache_of(self, name: str) -> Optional[ServiceCache]:
+        """Returns the cache that keeps service name, if its factory has one.
+        """
+        if not self.caches:
+            return None
+        try:
+            factory, _ = self.resolve(name)
+        except ValueError:
+            return None
+        return self.caches.get(factory.name)
+
+    def cache_for(self, factory: Factory) -> ServiceCache:
+        try:
+            return self.caches[factory.name]
+        except KeyError:
+            cache = self.caches[factory.name] = ServiceCache(
+                factory.maxsize, factory.ttl, factory.weak, name=factory.name
+            )
+            return cache
+
+    def cache_stats(self) -> dict:
+        """Returns the hits, misses and evictions of every bounded cache.
+        """
+        return {name: cache.stats() for name, cache in self.caches.items()}
+
+    def lookup(self, name: str):
+        """Returns the service if it is loaded, raises KeyError otherwise.
+        """
+        # services of self first, iterating the ChainMap allocates
+        result = self.services.maps[0].get(name, Missing)
+        if result is Missing:
+            return self.lookup_further(name)
+        if self.hooks.on_resolve_start:
+            self.resolving(name, name, "hit")
+        return result
+
+    def lookup_further(self, name: str):
+        """Looks service up in the services of parents and class, then in caches.
+        """
+        for services in self.services.maps:
+            if name in services:
+                result, key = services[name], name
+                break
+        else:
+            cache = self.cache_of(name)
+            if cache is None:
+                raise KeyError(name)
+            result, key = cache[name], cache.name
+        if self.hooks.on_resolve_start:
+            self.resolving(name, key, "hit")
+        return result
+
+    def resolving(self, name: str, key: str, state: str):
+        for callback in self.hooks.on_resolve_start:
+            callback(name, key, state)
+
+    def resolved(self, name: str, key: str, timing: Timing, future: asyncio.Future):
+        timing.end()
+        error = future.exception() if not future.cancelled() else asyncio.CancelledError()
+        for callback in self.hooks.on_resolve_end:
+            callback(name, key, timing, error)
+
+    def stats_key(self, name: str) -> str:
+        """Returns the name under which metrics of service are counted.
+        """
+        factory, _ = self.resolve(name)
+        return factory.stats_key(name)
+
+    def get(self, name: str, timeout: Optional[float] = None) -> asyncio.Future:
+        """Returns a future of service.
+
+        With timeout, or within deadline(), the future fails with
+        ResolveTimeoutError if the service is not loaded in time.
+        Cancelling the future cancels the load once no other caller waits for it.
+        """
         try:
-            result = self.services[name]
-            future.set_result(result)
+            result = self.lookup(name)
         except KeyError:
-            for fact, args in note_loop(name):
-                if fact in self.factories:
-                    func, singleton = self.factories[fact]
-                    if asyncio.iscoroutinefunction(func):
-                        task = asyncio.create_task(func(*args))
-                    else:
-                        loop = asyncio.get_running_loop()
-                        task = cast(
-                            asyncio.Task,
-                            loop.run_in_executor(self.executor, func, *args),
-                        )
+            if timeout is None:
+                timeout = self.remaining()
+                if timeout is None:
+                    return self.miss(name)
+            return asyncio.ensure_future(self.get_within(name, self.miss(name), timeout))
+        future: asyncio.Future = asyncio.Future()
+        future.set_result(result)
+        return future
+
+    def get_many(self, names, timeout: Optional[float] = None) -> asyncio.Future:
+        """Returns a future of a dict of services, keyed by name.
+
+        Each name is looked up once, and every missing service is loaded
+        concurrently. timeout works like with get().
+        """
+        results, futures = self.split(names)
+        if not futures:
+            future: asyncio.Future = asyncio.Future()
+            future.set_result(results)
+            return future
+        return asyncio.ensure_future(self.collect(results, futures, timeout))
+
+    def split(self, names) -> tuple:
+        """Returns the services of names that are loaded, and futures of the others.
+        """
+        results: dict = {}
+        futures: dict = {}
+        for name in names:
+            if name in results or name in futures:
+                continue
+            try:
+                results[name] = self.lookup(name)
+            except KeyError:
+                futures[name] = self.miss(name)
+        return results, futures
+
+    def miss(self, name: str) -> asyncio.Future:
+        """Returns a future of service, which is not loaded.
+
+        It raises CircularDependencyError when service is requested, as a
+        dependency, by its own factory.
+        """
+        chain = resolving_var.get()
+        if name in chain:
+            raise CircularDependencyError(
+                "Circular dependency %s"
+                % " -> ".join(chain[chain.index(name):] + (name,))
+            )
+        task = self.pending.get(name)
+        if task is None:
+            task = self.load(name)
+            if task is not self.pending.get(name):
+                # task is not shared with other callers
+                return task
+        elif self.hooks.on_resolve_start:
+            self.resolving(name, self.stats_key(name), "join")
+        future = asyncio.Future()
+        task.add_done_callback(partial(forward, future))
+        self.waiters[task] = self.waiters.get(task, 0) + 1
+        future.add_done_callback(partial(self.abandoned, name, task))
+        return future
+
+    async def get_within(self, name: str, future: asyncio.Future, timeout: float):
+        results = await self.collect({}, {name: future}, timeout)
+        return results[name]
+
+    async def collect(self, results: dict, futures: dict, timeout: Optional[float]) -> dict:
+        """Adds the services of futures, keyed by name, to results.
+
+        When it fails or is cancelled, futures left are cancelled, and
+        pooled services of the others that are not in results are released.
+        """
+        try:
+            if timeout is not None:
+                await self.within({future: name for name, future in futures.items()}, timeout)
+            for name, future in futures.items():
+                results[name] = await future
+            return results
+        except BaseException:
+            self.unwind(results, futures)
+            raise
+
+    def unwind(self, results: dict, futures: dict):
+        for name, future in futures.items():
+            if not future.done():
+                future.cancel()
+            elif name not in results and not future.cancelled() and not future.exception():
+                self.release(name, future.result())
+
+    async def within(self, futures: dict, timeout: float):
+        """Waits for futures of services, keyed by service name.
+        """
+        _, pending = await asyncio.wait(futures, timeout=max(timeout, 0))
+        if pending:
+            name = next(name for future, name in futures.items() if future in pending)
+            raise ResolveTimeoutError(name, self.blocking(name), timeout)
+
+    def blocking(self, name: str) -> list:
+        """Returns name, and the chain of pending dependencies it waits for.
+        """
+        path = [name]
+        while True:
+            for dep in self.dependencies_of(path[-1]):
+                if dep not in path and self.is_pending(dep):
+                    path.append(dep)
                     break
             else:
-                raise ValueError("%r is not defined" % name)
-            logger.info("Loading service=%s", name)
-            if singleton:
-                task.add_done_callback(
-                    lambda x: self.services.update({name: x.result()})
-                )
-            task.add_done_callback(lambda x: future.set_result(x.result()))
+                return path
+
+    def dependencies_of(self, name: str) -> tuple:
+        injector: MaybeInjector = self
+        while injector is not None:
+            if name in injector.dependencies:
+                return injector.dependencies[name]
+            injector = injector.parent
+        return ()
+
+    def is_pending(self, name: str) -> bool:
+        injector: MaybeInjector = self
+        while injector is not None:
+            if name in injector.pending:
+                return True
+            injector = injector.parent
+        return False
+
+    def abandoned(self, name: str, task: asyncio.Future, future: asyncio.Future):
+        """Cancels the load of service once every caller cancelled its future.
+        """
+        if not future.cancelled() or task.done():
+            return
+        count = self.waiters[task] - 1
+        if count:
+            self.waiters[task] = count
+            return
+        del self.waiters[task]
+        if self.pending.get(name) is task:
+            del self.pending[name]
+        task.cancel()
+
+    @contextmanager
+    def deadline(self, timeout: float):
+        """Services got or applied within the block must be resolved before timeout seconds.
+        """
+        deadline = asyncio.get_running_loop().time() + timeout
+        current = deadline_var.get()
+        token = deadline_var.set(deadline if current is None else min(current, deadline))
+        try:
+            yield
+        finally:
+            deadline_var.reset(token)
+
+    def remaining(self) -> Optional[float]:
+        """Returns the seconds left before the current deadline, if there is one.
+        """
+        deadline = deadline_var.get()
+        if deadline is None:
+            return None
+        return deadline - asyncio.get_running_loop().time()
+
+    def load(self, name: str) -> asyncio.Future:
+        """Starts the factory of service.
+
+        Singletons are loaded only once at a time, concurrent callers share
+        the same pending task until the service is stored.
+        """
+        factory, args = self.resolve(name)
+        if self.parent is not None and not factory.scoped:
+            if factory.name not in self.factories.maps[0]:
+                return self.parent.get(name)
+        if self.failures and name in self.failures:
+            failure = self.failed(name, factory)
+            if failure is not None:
+                return failure
+        if factory.annotation and (factory.pool or factory.singleton and not factory.bounded):
+            self.dependencies[name] = tuple(
+                service for _, service in factory.dependencies(args)
+            )
+        if factory.pool:
+            pool = self.pool_for(name, factory, args)
+            return asyncio.create_task(pool.acquire())
+        if factory.batch:
+            task = self.call_batched(factory, args, name, factory.stats_key(name))
+        else:
+            task = self.call(factory, args, name, factory.stats_key(name))
+        self.track(name, factory, task)
+        return task
+
+    def track(self, name: str, factory: Factory, task: asyncio.Future):
+        """Stores the service loaded by task, and records its failures.
+        """
+        if factory.singleton:
+            self.pending[name] = task
+            task.add_done_callback(lambda x: self.loaded(name, factory, x))
+        if factory.negative_ttl:
+            task.add_done_callback(partial(self.settled, name, factory))
+        if factory.bounded:
+            self.cache_for(factory).misses += 1
+
+    def failed(self, name: str, factory: Factory) -> Optional[asyncio.Future]:
+        """Returns a failed future while the factory of service backs off.
+        """
+        error, failures, retry_at = self.failures[name]
+        delay = retry_at - monotonic()
+        if delay <= 0:
+            return None
+        if self.hooks.on_resolve_start:
+            self.resolving(name, factory.stats_key(name), "failed")
+        future = asyncio.get_running_loop().create_future()
+        exc = ServiceFailedError(
+            "Service %r failed %d times, retry in %.3fs" % (name, failures, delay)
+        )
+        exc.__cause__ = error
+        future.set_exception(exc)
         return future
 
+    def settled(self, name: str, factory: Factory, task: asyncio.Future):
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is None:
+            self.failures.pop(name, None)
+            return
+        failures = self.failures[name][1] + 1 if name in self.failures else 1
+        delay = factory.backoff(failures)
+        self.failures[name] = (error, failures, monotonic() + delay)
+        logger.warning("Service %s failed, not loaded again for %.3fs", name, delay)
+
+    def call(self, factory: Factory, args, name: str, key: str) -> asyncio.Future:
+        if self.hooks.on_resolve_start:
+            self.resolving(name, key, "load")
+        timing = Timing() if self.hooks.on_resolve_end else None
+        future: asyncio.Future
+        if factory.annotation or factory.max_concurrency or factory.persist:
+            future = asyncio.create_task(self.produce(name, factory, args, timing))
+        elif factory.is_coro:
+            future = asyncio.create_task(factory.func(*args))
+        else:
+            future = self.run_sync(factory, args, timing=timing)
+        if timing is not None:
+            future.add_done_callback(partial(self.resolved, name, key, timing))
+        return future
+
+    def call_batched(self, factory: Factory, args, name: str, key: str) -> asyncio.Future:
+        if self.hooks.on_resolve_start:
+            self.resolving(name, key, "load")
+        future = self.batch_for(factory).add(":".join(args))
+        if self.hooks.on_resolve_end:
+            future.add_done_callback(partial(self.resolved, name, key, Timing()))
+        return future
+
+    def batch_for(self, factory: Factory) -> BatchLoader:
+        try:
+            return self.batches[factory.name]
+        except KeyError:
+            batch = self.batches[factory.name] = BatchLoader(
+                lambda keys: self.produce(factory.name, factory, (keys,), None),
+                name=factory.name,
+                window=factory.batch_window,
+            )
+            return batch
+
+    def batch_stats(self) -> dict:
+        """Returns the number of batches and keys loaded by every batch factory.
+        """
+        return {name: batch.stats() for name, batch in self.batches.items()}
+
+    def pool_for(self, name: str, factory: Factory, args) -> ServicePool:
+        try:
+            return self.pools[name]
+        except KeyError:
+            pool = self.pools[name] = ServicePool(
+                lambda: self.call(factory, args, name, factory.name),
+                factory.pool,
+                minsize=factory.pool_min,
+                idle_timeout=factory.idle_timeout,
+                acquire_timeout=factory.acquire_timeout,
+            )
+            self.close.register(pool)
+            return pool
+
+    def release(self, name: str, instance):
+        """Gives back an instance of a pooled service, borrowed with get().
+        """
+        pool = self.pools.get(name)
+        if pool is not None and id(instance) in pool.borrowed:
+            pool.release(instance)
+            return
+        for pool in self.draining:
+            if id(instance) in pool.borrowed:
+                pool.release(instance)
+                if not pool.borrowed:
+                    self.draining.remove(pool)
+                return
+
+    def release_lazy(self, kwargs: dict):
+        """Gives back the pooled services borrowed by the lazy handles of kwargs.
+        """
+        for value in kwargs.values():
+            if isinstance(value, LazyService):
+                value.release()
+
+    @asynccontextmanager
+    async def borrow(self, name: str):
+        """Borrows an instance of a pooled service for the duration of the block.
+        """
+        instance = await self.get(name)
+        try:
+            yield instance
+        finally:
+            self.release(name, instance)
+
+    def bulkhead_for(self, factory: Factory) -> Bulkhead:
+        try:
+            return self.bulkheads[factory.name]
+        except KeyError:
+            bulkhead = self.bulkheads[factory.name] = Bulkhead(
+                factory.max_concurrency, factory.queue_limit, name=factory.name
+            )
+            return bulkhead
+
+    def bulkhead_stats(self) -> dict:
+        """Returns the running, queued and rejected calls of every limited factory.
+        """
+        return {name: bulkhead.stats() for name, bulkhead in self.bulkheads.items()}
+
+    def pool_stats(self) -> dict:
+        """Returns the size, idle, borrowed and waiting counts of every pool.
+        """
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+    async def produce(self, name: str, factory, args, timing: Optional[Timing]):
+        """Loads the declared dependencies of factory, then calls it.
+
+        Persisted factories are not called when their snapshot is found.
+        """
+        resolving_var.set(resolving_var.get() + (name,))
+        # callers enforce their deadline, and cancel the load when it passes
+        deadline_var.set(None)
+        if factory.persist:
+            return await self.restore(factory, args, timing)
+        async with self.inject(factory, args) as kwargs:
+            return await self.invoke(factory, args, kwargs, timing)
+
+    async def restore(self, factory, args, timing: Optional[Timing]):
+        name = ":".join((factory.name,) + tuple(args))
+        fingerprint = factory.fingerprint(args)
+        try:
+            return await self.executors["default"].run(self.store.load, name, fingerprint)
+        except KeyError:
+            pass
+        async with self.inject(factory, args) as kwargs:
+            result = await self.invoke(factory, args, kwargs, timing)
+        try:
+            await self.executors["default"].run(self.store.save, name, fingerprint, result)
+        except Exception:
+            logger.warning("Failed to persist service=%s", name, exc_info=True)
+        return result
+
+    @asynccontextmanager
+    async def inject(self, factory, args):
+        """Yields the declared dependencies of factory, as keyword arguments.
+
+        Like with apply(), pooled services are given back after the block,
+        lazy ones included.
+        """
+        dependencies = factory.dependencies(args)
+        values = await asyncio.gather(
+            *(self.get(service) for _, service in dependencies), return_exceptions=True
+        )
+        kwargs: dict = {}
+        try:
+            for value in values:
+                if isinstance(value, BaseException):
+                    raise value
+            kwargs.update((key, value) for (key, _), value in zip(dependencies, values))
+            if factory.annotation and factory.annotation.lazy:
+                for key, service in factory.annotation.missing(args, {}):
+                    if isinstance(service, lazy):
+                        kwargs[key] = LazyService(self, str(service))
+            yield kwargs
+        finally:
+            if self.pools or self.draining:
+                for (_, service), value in zip(dependencies, values):
+                    self.release(service, value)
+                self.release_lazy(kwargs)
+
+    async def invoke(self, factory, args, kwargs, timing: Optional[Timing]):
+        if factory.max_concurrency:
+            async with self.bulkhead_for(factory):
+                return await self.call_factory(factory, args, kwargs, timing)
+        return await self.call_factory(factory, args, kwargs, timing)
+
+    async def call_factory(self, factory, args, kwargs, timing: Optional[Timing]):
+        if factory.is_coro:
+            if timing is not None:
+                timing.start()
+            return await factory.func(*args, **kwargs)
+        return await self.run_sync(factory, args, kwargs, timing)
+
+    def loaded(self, name: str, factory: Factory, task: asyncio.Future):
+        if self.pending.get(name) is task:
+            del self.pending[name]
+        self.waiters.pop(task, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        if factory.bounded:
+            self.cache_for(factory)[name] = task.result()
+        else:
+            self.services[name] = task.result()
+        if factory.refresh_every:
+            self.schedule(name, factory.refresh_every)
+
+    def graph(self, names) -> dict:
+        """Returns the declared dependencies of names, and of their dependencies.
+
+        Services that are already loaded are leaves of the graph.
+        """
+        graph: dict = {}
+        todo = list(names)
+        while todo:
+            name = todo.pop()
+            if name in graph:
+                continue
+            if self.try_get(name, Missing) is not Missing:
+                graph[name] = ()
+                continue
+            factory, args = self.resolve(name)
+            deps = graph[name] = tuple(
+                service for _, service in factory.dependencies(args)
+            )
+            todo.extend(deps)
+        return graph
+
+    async def warmup(self, names, *, concurrency: Optional[int] = None) -> dict:
+        """Loads services with their dependencies.
+
+        Dependencies are loaded level by level, every service of a level is
+        loaded concurrently, but no more than concurrency at a time.
+        Cycles are detected before calling any factory.
+        """
+        levels = toposort(self.graph(names))
+        semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+
+        async def load(name):
+            if semaphore is None:
+                return await self.get(name)
+            async with semaphore:
+                return await self.get(name)
+
+        results = {}
+        for level in levels:
+            values = await asyncio.gather(*map(load, level))
+            results.update(zip(level, values))
+        return {name: results[name] for name in names}
+
+    async def prefork(self, names=(), *, freeze=False) -> dict:
+        """Loads services before the process forks, and keeps them in forked children.
+
+        names and services of ``fork_safe=True`` factories are kept by the
+        children, and shared copy-on-write with the parent. Everything else
+        is dropped in the children: other services, pools, and pending loads.
+        Executors are replaced by new ones of the same kind.
+        With freeze, every object tracked by the garbage collector is frozen,
+        so that collections in children do not copy them. They are never
+        collected again, in the parent process too.
+        """
+        results = await self.warmup(names)
+        self.fork_safe = self.fork_safe.union(names)
+        PREFORKED.add(self)
+        if freeze:
+            gc.collect()
+            gc.freeze()
+        return results
+
+    def is_fork_safe(self, name: str) -> bool:
+        if name in self.fork_safe:
+            return True
+        try:
+            factory, _ = self.resolve(name)
+        except ValueError:
+            return False
+        return factory.fork_safe
+
+    def after_fork(self):
+        """Drops what a forked child cannot share with its parent.
+        """
+        kept = {
+            name: service
+            for name, service in self.services.maps[0].items()
+            if self.is_fork_safe(name)
+        }
+        self.services.maps[0].clear()
+        self.services.maps[0].update(kept)
+        for name, cache in list(self.caches.items()):
+            if not self.is_fork_safe(name):
+                cache.clear()
+        self.dependencies = {
+            name: deps for name, deps in self.dependencies.items() if name in kept
+        }
+        registry = self.close.registry
+        self.close.registry = WeakKeyDictionary()
+        for service in kept.values():
+            try:
+                if service in registry:
+                    self.close.registry[service] = registry[service]
+            except TypeError:
+                continue
+        # threads and event loop of the parent are gone
+        default = self.__dict__.pop("executor", None)
+        executors = self.__dict__.pop("executors", None)
+        if executors is not None:
+            self.executors = {name: tracked.respawn() for name, tracked in executors.items()}
+            if default is not None and executors["default"].executor is default:
+                self.executor = self.executors["default"].executor
+        self.pending = {}
+        self.waiters = {}
+        self.refreshing = {}
+        self.scheduler = None
+        self.failures = {}
+        self.pools = {}
+        self.draining = []
+        self.batches = {}
+        self.bulkheads = {}
+
+    def get_nowait(self, name: str):
+        """Returns the service if it is already loaded, raises KeyError otherwise.
+        """
+        return self.lookup(name)
+
+    def try_get(self, name: str, default=None):
+        """Returns the service if it is already loaded, default otherwise.
+        """
+        try:
+            return self.lookup(name)
+        except KeyError:
+            return default
+
     def set(self, name: str, value):
         self.services[name] = value
 
@@ -210,39 +2077,90 @@ class Injector(metaclass=ABCMeta):
                 return self.do_apply(func, anno, args, kwargs)
             result = func(*args, **kwargs)
             if isinstance(func, type):
-                TAINTED[result] = self
+                with suppress(TypeError):  # instance cannot be weakly referenced
+                    TAINTED[result] = self
             fut: asyncio.Future = asyncio.Future()
             fut.set_result(result)
             return fut
 
-    def do_apply(self, func, anno, args, kwargs):
-        given = anno.given(*args, **kwargs)
-        services = {
-            key: self.get(service)
-            for key, service in anno.markers.items()
-            if key not in given
-        }
-        logger.info("Apply services=%s to func=%r", ",".join(services.keys()), func)
+    def do_apply(self, func, anno, args, kwargs, timeout: Optional[float] = None):
+        missing = anno.missing(args, kwargs)
+        kwargs = dict(kwargs)
+        futures = self.fill(anno, missing, kwargs)
+        if self.hooks.on_apply:
+            self.applying(func, missing)
+
+        if not futures and not anno.is_coro:
+            # every service is loaded, no need to schedule anything
+            fut: asyncio.Future = asyncio.Future()
+            try:
+                fut.set_result(func(*args, **kwargs))
+            except Exception as error:
+                fut.set_exception(error)
+            return fut
+
+        if timeout is None:
+            timeout = self.remaining()
+        return asyncio.create_task(
+            self.applied(func, anno, args, kwargs, missing, futures, timeout)
+        )
+
+    def fill(self, anno, missing, kwargs: dict) -> Optional[dict]:
+        """Fills kwargs with the services of missing markers that are loaded.
+
+        It returns futures of the other services, keyed by name, if any.
+        """
+        futures: Optional[dict] = None
+        for key, service in missing:
+            if anno.lazy and isinstance(service, lazy):
+                kwargs[key] = LazyService(self, str(service))
+                continue
+            try:
+                kwargs[key] = self.lookup(service)
+            except KeyError:
+                # like get_many(), each missing service is requested once
+                if futures is None:
+                    futures = {}
+                if service not in futures:
+                    futures[service] = self.miss(service)
+        return futures
+
+    def applying(self, func, missing):
+        names = [service for _, service in missing]
+        for callback in self.hooks.on_apply:
+            callback(func, names)
 
-        async def run(args, kwargs):
-            kwargs = dict(kwargs)
-            for k, v in services.items():
-                kwargs[k] = await v
+    async def applied(self, func, anno, args, kwargs, missing, futures, timeout):
+        services: dict = {}
+        try:
+            if futures:
+                await self.collect(services, futures, timeout)
+                for key, service in missing:
+                    if service in services:
+                        kwargs[key] = services[service]
             result = func(*args, **kwargs)
             if anno.is_coro:
                 result = await result
             return result
+        finally:
+            if self.pools or self.draining:
+                for service, instance in services.items():
+                    self.release(service, instance)
+                if anno.lazy:
+                    self.release_lazy(kwargs)
 
-        return asyncio.create_task(run(args, kwargs))
+    def partial(self, func, *, timeout: Optional[float] = None):
+        """Returns func, with services injected at each call.
 
-    def partial(self, func):
+        With timeout, services of each call must be resolved within timeout seconds.
+        """
         orig = unwrap(func)
         anno = ANNOTATIONS.get(orig)
         if anno:
 
             @wraps(func)
             def parted(*args, **kwargs):
-                return self.do_apply(func, anno, args, kwargs)
+                return self.do_apply(func, anno, args, kwargs, timeout)
 
             return parted
         return func
@@ -256,18 +2174,19 @@ class Injector(metaclass=ABCMeta):
             current_injector_var.reset(token)
 
 
+def after_fork():
+    for injector in list(PREFORKED):
+        injector.after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=after_fork)
+
+
 def attr(service, *, init=True, repr=True, hash=None, compare=True, metadata=None):
     metadata = (metadata or {}).copy()
     metadata[KNIGHTED_NAMESPACE] = service
-    return Field(
-        default=MISSING,
-        default_factory=MISSING,
-        init=True,
-        repr=True,
-        hash=None,
-        compare=True,
-        metadata=metadata,
-    )
+    return field(init=init, repr=repr, hash=hash, compare=compare, metadata=metadata)
 
 
 def attr_lazy(service):
@@ -275,33 +2194,113 @@ def attr_lazy(service):
 
 
 class Attr:
+    """Awaitable attribute, resolved by the injector of its instance.
+
+    The service is requested on first access, and its future is kept by the
+    instance, in its __dict__, or for classes with __slots__ in a mapping by
+    identity. Failed futures are forgotten, so that next accesses retry.
+    """
+
     def __init__(self, service):
         self.service = service
+        self.field_name = None
+        self.slotted = IdentityMap()
 
     def __get__(self, obj, objtype):
         if obj is None:
             return self
-        fut = obj.__dict__[self.field_name] = asyncio.Future()
-        task = asyncio.create_task(self.load(obj))
-        task.add_done_callback(lambda x: fut.set_result(x.result()))
-        return fut
+        future = self.memo(obj)
+        if future is None:
+            future = self.remember(obj, injector_of(obj).get(self.service))
+        return future
 
     def __set_name__(self, owner, name):
         self.field_name = name
 
-    async def load(self, obj):
-        fut = (TAINTED.get(obj) or current_injector_var.get()).get(self.service)
-        return await fut
-
-
-def note_loop(note):
-    args = note.split(":")
-    results = []
-    fact, *args = args
-    results.append((fact, args))
-    while args:
-        suffix, *args = args
-        fact = "%s:%s" % (fact, suffix)
-        results.append((fact, args))
-    for fact, args in sorted(results, reverse=True):
-        yield fact, args
+    def memo(self, obj) -> Optional[asyncio.Future]:
+        # instances with a __dict__ shadow the descriptor once remembered
+        return self.slotted.get(obj)
+
+    def remember(self, obj, future: asyncio.Future) -> asyncio.Future:
+        try:
+            obj.__dict__[self.field_name] = future
+        except AttributeError:
+            with suppress(TypeError):  # instance cannot be weakly referenced
+                self.slotted[obj] = future
+        if not future.done():
+            future.add_done_callback(partial(self.forget, obj))
+        return future
+
+    def forget(self, obj, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is None:
+            return
+        try:
+            if obj.__dict__.get(self.field_name) is future:
+                del obj.__dict__[self.field_name]
+        except AttributeError:
+            if self.slotted.get(obj) is future:
+                del self.slotted[obj]
+
+
+def injector_of(obj) -> Injector:
+    """Returns the injector that built obj, or the current one.
+    """
+    return TAINTED.get(obj) or current_injector_var.get()
+
+
+def lazy_attrs(cls) -> dict:
+    """Returns the attr_lazy descriptors of cls, by attribute name.
+    """
+    try:
+        return LAZY_ATTRS[cls]
+    except KeyError:
+        pass
+    attrs = LAZY_ATTRS[cls] = {
+        name: value
+        for klass in reversed(cls.__mro__)
+        for name, value in vars(klass).items()
+        if isinstance(value, Attr)
+    }
+    return attrs
+
+
+async def resolve_lazy(obj) -> dict:
+    """Loads every attr_lazy attribute of obj concurrently.
+
+    Services are requested in one pass, and remembered by obj. It returns
+    them by attribute name.
+    """
+    attrs = lazy_attrs(type(obj))
+    missing = {}
+    for name, attr in attrs.items():
+        if name not in getattr(obj, "__dict__", ()) and attr.memo(obj) is None:
+            missing[name] = attr
+    if missing:
+        services = await injector_of(obj).get_many(attr.service for attr in missing.values())
+        loop = asyncio.get_running_loop()
+        for name, attr in missing.items():
+            future = loop.create_future()
+            future.set_result(services[attr.service])
+            attr.remember(obj, future)
+    return {name: await getattr(obj, name) for name in attrs}
+
+
+def toposort(graph: dict) -> list:
+    """Sorts graph of dependencies into levels.
+
+    Every name of a level only depends on names of previous levels.
+    """
+    remaining = {name: set(deps) for name, deps in graph.items()}
+    levels = []
+    while remaining:
+        level = sorted(name for name, deps in remaining.items() if not deps)
+        if not level:
+            raise CircularDependencyError(
+                "Circular dependency among %s" % ", ".join(sorted(remaining))
+            )
+        for name in level:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(level)
+        levels.append(level)
+    return levels
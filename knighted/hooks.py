@@ -0,0 +1,119 @@
+"""Instrumentation hooks of injectors.
+
+Every event is a list of callbacks, which stays empty until something
+subscribes to it. Emitting an event to no subscriber costs one attribute
+check.
+"""
+
+from __future__ import annotations
+
+import logging
+from time import perf_counter
+from typing import Optional
+
+logger = logging.getLogger("knighted")
+
+EVENTS = ("on_resolve_start", "on_resolve_end", "on_apply", "on_close")
+
+
+class Hooks:
+    """Subscribers to the events of an injector.
+
+    ``on_resolve_start(name, key, state)`` is emitted when a service is
+    requested. state is ``"hit"`` when the service is loaded already,
+    ``"join"`` when it waits for a pending load, ``"load"`` when its factory
+    is called, ``"failed"`` when its factory backs off after failures. key is
+    the name metrics are counted under.
+
+    ``on_resolve_end(name, key, timing, error)`` is emitted when a factory
+    call completes, error is None on success.
+
+    ``on_apply(func, names)`` is emitted when an annotated callable is
+    applied, with the names of the services it misses.
+
+    ``on_close(report)`` is emitted once the injector is closed.
+    """
+
+    __slots__ = EVENTS
+
+    def __init__(self):
+        for event in EVENTS:
+            setattr(self, event, [])
+
+    def subscribe(self, subscriber):
+        """Subscribes every on_* method of subscriber to its event.
+        """
+        for event in EVENTS:
+            callback = getattr(subscriber, event, None)
+            if callback is not None:
+                getattr(self, event).append(callback)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        for event in EVENTS:
+            callback = getattr(subscriber, event, None)
+            if callback is not None and callback in getattr(self, event):
+                getattr(self, event).remove(callback)
+
+
+class Timing:
+    """Times one factory call.
+
+    Factories run by a thread pool mark when a worker starts them.
+    """
+
+    __slots__ = ("submitted", "started", "ended")
+
+    def __init__(self):
+        self.submitted = perf_counter()
+        self.started: Optional[float] = None
+        self.ended: Optional[float] = None
+
+    def start(self):
+        """Marks the factory as running, may be called from a worker thread.
+        """
+        self.started = perf_counter()
+
+    def end(self):
+        self.ended = perf_counter()
+        if self.started is None:
+            self.started = self.submitted
+
+    @property
+    def wait(self) -> float:
+        return self.started - self.submitted
+
+    @property
+    def run(self) -> float:
+        return self.ended - self.started
+
+
+class EventLogger:
+    """Logs events of an injector.
+    """
+
+    def __init__(self, level=logging.INFO):
+        self.level = level
+
+    def on_resolve_start(self, name, key, state):
+        if state == "load" and logger.isEnabledFor(self.level):
+            logger.log(self.level, "Loading service=%s", name)
+
+    def on_resolve_end(self, name, key, timing, error):
+        if error is not None:
+            logger.warning("Failed to load service=%s", name, exc_info=error)
+        elif logger.isEnabledFor(self.level):
+            logger.log(self.level, "Loaded service=%s in %.6fs", name, timing.run)
+
+    def on_apply(self, func, names):
+        if logger.isEnabledFor(self.level):
+            logger.log(self.level, "Apply services=%s to func=%r", ",".join(names), func)
+
+    def on_close(self, report):
+        logger.log(
+            self.level,
+            "Closed %d objects, %d failed, %d missed the deadline",
+            len(report.closed),
+            len(report.failed),
+            len(report.missed),
+        )
@@ -0,0 +1,168 @@
+"""Resolution metrics of injectors.
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_left
+
+#: upper bounds of histogram buckets, in seconds
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+
+class Histogram:
+    """Distribution of durations, in seconds.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def snapshot(self) -> dict:
+        cumulative, total = {}, 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            cumulative[bound] = total
+        total += self.counts[-1]
+        cumulative[float("inf")] = total
+        return {"buckets": cumulative, "sum": self.sum, "count": total}
+
+
+class ServiceStats:
+    """Counters of one service.
+
+    wait measures the time between a factory call and the moment it starts
+    running, which includes loading its dependencies and waiting for an
+    executor slot. run measures the factory itself.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.calls = 0
+        self.failures = 0
+        self.backoffs = 0
+        self.in_flight = 0
+        self.wait = Histogram()
+        self.run = Histogram()
+
+    def snapshot(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "calls": self.calls,
+            "failures": self.failures,
+            "backoffs": self.backoffs,
+            "in_flight": self.in_flight,
+            "wait": self.wait.snapshot(),
+            "run": self.run.snapshot(),
+        }
+
+
+class Metrics:
+    """Counters of every service of an injector.
+
+    Metrics are collected by subscribing to the hooks of an injector.
+    """
+
+    def __init__(self):
+        self.services: dict = {}
+
+    def on_resolve_start(self, name, key, state):
+        stats = self.service(key)
+        if state == "hit":
+            stats.hits += 1
+            return
+        if state == "failed":
+            stats.backoffs += 1
+            return
+        stats.misses += 1
+        if state == "load":
+            stats.calls += 1
+            stats.in_flight += 1
+
+    def on_resolve_end(self, name, key, timing, error):
+        stats = self.service(key)
+        stats.in_flight -= 1
+        stats.wait.observe(timing.wait)
+        stats.run.observe(timing.run)
+        if error is not None:
+            stats.failures += 1
+
+    def service(self, name: str) -> ServiceStats:
+        try:
+            return self.services[name]
+        except KeyError:
+            stats = self.services[name] = ServiceStats()
+            return stats
+
+    def snapshot(self) -> dict:
+        return {name: stats.snapshot() for name, stats in self.services.items()}
+
+
+def render_prometheus(snapshot: dict, prefix: str = "knighted") -> str:
+    """Renders the snapshot returned by Injector.stats() in Prometheus text format.
+    """
+    lines = []
+
+    def family(name, kind, text):
+        lines.append("# HELP %s_%s %s" % (prefix, name, text))
+        lines.append("# TYPE %s_%s %s" % (prefix, name, kind))
+
+    def sample(name, labels, value):
+        rendered = ",".join('%s="%s"' % (key, escape(val)) for key, val in labels)
+        lines.append("%s_%s{%s} %s" % (prefix, name, rendered, number(value)))
+
+    services = snapshot.get("services", {})
+    for key, kind, text in (
+        ("hits", "counter", "Services found loaded."),
+        ("misses", "counter", "Services not loaded yet."),
+        ("calls", "counter", "Factory calls."),
+        ("failures", "counter", "Factory calls that failed."),
+        ("backoffs", "counter", "Requests failed by a factory backing off."),
+        ("in_flight", "gauge", "Factory calls running."),
+    ):
+        name = "service_%s%s" % (key, "_total" if kind == "counter" else "")
+        family(name, kind, text)
+        for service, stats in sorted(services.items()):
+            sample(name, [("service", service)], stats[key])
+    for key, text in (
+        ("wait", "Time before factories start running, in seconds."),
+        ("run", "Time factories run, in seconds."),
+    ):
+        name = "service_%s_seconds" % key
+        family(name, "histogram", text)
+        for service, stats in sorted(services.items()):
+            histogram = stats[key]
+            for bound, count in histogram["buckets"].items():
+                labels = [("service", service), ("le", number(bound))]
+                sample(name + "_bucket", labels, count)
+            sample(name + "_sum", [("service", service)], histogram["sum"])
+            sample(name + "_count", [("service", service)], histogram["count"])
+
+    executors = snapshot.get("executors", {})
+    for key, kind, text in (
+        ("submitted", "counter", "Jobs submitted to executor."),
+        ("in_flight", "gauge", "Jobs queued or running in executor."),
+        ("queued", "gauge", "Jobs waiting for an executor worker."),
+        ("peak_queued", "gauge", "Highest number of jobs waiting for a worker."),
+    ):
+        name = "executor_%s%s" % (key, "_total" if kind == "counter" else "")
+        family(name, kind, text)
+        for executor, stats in sorted(executors.items()):
+            sample(name, [("executor", executor)], stats[key])
+    return "\n".join(lines) + "\n"
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,96 @@
+"""On-disk snapshots of services.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from contextlib import suppress
+from pathlib import Path
+
+logger = logging.getLogger("knighted")
+
+
+def digest(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()[:32]
+
+
+class SnapshotStore:
+    """Pickled services in a directory, keyed by service name and fingerprint.
+
+    Snapshots are written atomically. A new snapshot of a service replaces
+    the ones of older fingerprints, and least recently used snapshots are
+    removed once the directory holds more than max_bytes.
+    """
+
+    suffix = ".pickle"
+
+    def __init__(self, directory, max_bytes: int = 512 * 2 ** 20):
+        self.directory = Path(directory).expanduser()
+        self.max_bytes = max_bytes
+
+    def path(self, name: str, fingerprint: str) -> Path:
+        return self.directory / (
+            "%s-%s%s" % (digest(name), digest(fingerprint), self.suffix)
+        )
+
+    def load(self, name: str, fingerprint: str):
+        """Returns the snapshot of service, raises KeyError if there is none.
+        """
+        path = self.path(name, fingerprint)
+        try:
+            with open(path, "rb") as file:
+                value = pickle.load(file)
+        except FileNotFoundError:
+            raise KeyError(name)
+        except Exception:
+            logger.warning("Dropping unreadable snapshot %s", path, exc_info=True)
+            with suppress(FileNotFoundError):
+                path.unlink()
+            raise KeyError(name)
+        with suppress(FileNotFoundError):
+            os.utime(path)  # recently used
+        return value
+
+    def save(self, name: str, fingerprint: str, value):
+        path = self.path(name, fingerprint)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=self.directory, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp, path)
+        except BaseException:
+            with suppress(FileNotFoundError):
+                os.unlink(temp)
+            raise
+        for stale in self.directory.glob("%s-*%s" % (digest(name), self.suffix)):
+            if stale != path:
+                with suppress(FileNotFoundError):
+                    stale.unlink()
+        self.prune()
+
+    def prune(self):
+        """Removes least recently used snapshots until the store fits max_bytes.
+        """
+        entries = []
+        for path in self.directory.glob("*" + self.suffix):
+            with suppress(FileNotFoundError):
+                stat = path.stat()
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            with suppress(FileNotFoundError):
+                path.unlink()
+            total -= size
+
+    def stats(self) -> dict:
+        sizes = [path.stat().st_size for path in self.directory.glob("*" + self.suffix)]
+        return {"snapshots": len(sizes), "bytes": sum(sizes), "max_bytes": self.max_bytes}
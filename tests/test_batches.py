@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from knighted import Injector, annotate
+
+
+@pytest.fixture
+def services():
+    class MyInjector(Injector):
+        pass
+
+    return MyInjector()
+
+
+@pytest.mark.asyncio
+async def test_batch_one_tick(services):
+    calls = []
+
+    @services.factory("user", batch=True)
+    async def users(ids):
+        calls.append(sorted(ids))
+        return {id: "user %s" % id for id in ids}
+
+    names = ["user:%d" % i for i in range(5)]
+    results = await asyncio.gather(*map(services.get, names))
+    assert results == ["user %d" % i for i in range(5)]
+    assert calls == [["0", "1", "2", "3", "4"]]
+
+    # loaded keys are cached, only new ones are requested
+    results = await asyncio.gather(services.get("user:1"), services.get("user:9"))
+    assert results == ["user 1", "user 9"]
+    assert calls[1:] == [["9"]]
+    assert services.stats()["batches"]["user"] == {"batches": 2, "keys": 6, "waiting": 0}
+
+
+@pytest.mark.asyncio
+async def test_batch_window(services):
+    calls = []
+
+    @services.factory("user", batch=True, batch_window=0.2, singleton=False)
+    def users(ids):
+        calls.append(sorted(ids))
+        return {id: int(id) for id in ids}
+
+    first = services.get("user:1")
+    for _ in range(3):
+        # without a window, the batch would be dispatched by now
+        await asyncio.sleep(0)
+    second = services.get("user:2")
+    assert calls == []
+    assert await asyncio.gather(first, second) == [1, 2]
+    assert calls == [["1", "2"]]
+
+
+@pytest.mark.asyncio
+async def test_batch_missing_key(services):
+    @services.factory("user", batch=True, singleton=False)
+    async def users(ids):
+        return {id: id for id in ids if id != "2"}
+
+    one, two = await asyncio.gather(
+        services.get("user:1"), services.get("user:2"), return_exceptions=True
+    )
+    assert one == "1"
+    assert isinstance(two, KeyError)
+
+
+@pytest.mark.asyncio
+async def test_batch_failure(services):
+    @services.factory("user", batch=True, singleton=False)
+    async def users(ids):
+        raise RuntimeError("down")
+
+    results = await asyncio.gather(
+        services.get("user:1"), services.get("user:2"), return_exceptions=True
+    )
+    assert [type(result) for result in results] == [RuntimeError, RuntimeError]
+
+
+@pytest.mark.asyncio
+async def test_batch_dependencies(services):
+    services["prefix"] = "user"
+
+    @services.factory("user", batch=True)
+    @annotate(prefix="prefix")
+    def users(ids, prefix):
+        return {id: "%s %s" % (prefix, id) for id in ids}
+
+    @annotate("user:1", "user:2")
+    def both(a, b):
+        return a, b
+
+    assert await services.apply(both) == ("user 1", "user 2")
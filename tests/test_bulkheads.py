@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from knighted import BulkheadFullError, Injector, annotate
+
+
+@pytest.fixture
+def services():
+    class MyInjector(Injector):
+        pass
+
+    return MyInjector()
+
+
+@pytest.fixture
+def running():
+    return {"now": 0, "peak": 0}
+
+
+@pytest.mark.asyncio
+async def test_max_concurrency(services, running):
+    @services.factory("conn", singleton=False, max_concurrency=2)
+    async def conn():
+        running["now"] += 1
+        running["peak"] = max(running["peak"], running["now"])
+        await asyncio.sleep(0.01)
+        running["now"] -= 1
+        return "conn"
+
+    results = await asyncio.gather(*(services.get("conn") for _ in range(6)))
+    assert results == ["conn"] * 6
+    assert running["peak"] == 2
+
+    stats = services.stats()["bulkheads"]["conn"]
+    assert stats["admitted"] == 6
+    assert stats["peak_queued"] == 4
+    assert stats["active"] == stats["queued"] == stats["rejected"] == 0
+    assert stats["wait_max"] > 0
+
+
+@pytest.mark.asyncio
+async def test_queue_limit(services):
+    @services.factory("conn", singleton=False, max_concurrency=1, queue_limit=1)
+    async def conn():
+        await asyncio.sleep(0.01)
+        return "conn"
+
+    results = await asyncio.gather(
+        *(services.get("conn") for _ in range(3)), return_exceptions=True
+    )
+    assert results[:2] == ["conn", "conn"]
+    assert isinstance(results[2], BulkheadFullError)
+    assert services.bulkhead_stats()["conn"]["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_sync_factories_with_dependencies(services, running):
+    services["dsn"] = "db://"
+
+    @services.factory("conn", singleton=False, max_concurrency=1)
+    @annotate("dsn")
+    def conn(dsn):
+        running["now"] += 1
+        running["peak"] = max(running["peak"], running["now"])
+        running["now"] -= 1
+        return dsn
+
+    @annotate("conn", "conn")
+    def both(first, second):
+        return first, second
+
+    assert await services.apply(both) == ("db://", "db://")
+    assert running["peak"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter(services):
+    @services.factory("conn", singleton=False, max_concurrency=1)
+    async def conn():
+        await asyncio.sleep(0.01)
+        return "conn"
+
+    first, second, third = (services.get("conn") for _ in range(3))
+    await asyncio.sleep(0)
+    second.cancel()
+    assert await first == "conn"
+    assert await third == "conn"
+    assert services.bulkhead_stats()["conn"]["active"] == 0
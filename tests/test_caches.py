@@ -0,0 +1,112 @@
+import asyncio
+import gc
+
+import pytest
+
+from knighted import Injector
+
+
+@pytest.fixture
+def services():
+    class MyInjector(Injector):
+        pass
+
+    return MyInjector()
+
+
+class User:
+    def __init__(self, id):
+        self.id = id
+
+
+@pytest.mark.asyncio
+async def test_maxsize(services):
+    calls = []
+
+    @services.factory("user", maxsize=2)
+    def user_factory(id):
+        calls.append(id)
+        return User(id)
+
+    user1 = await services.get("user:1")
+    await services.get("user:2")
+    assert (await services.get("user:1")) is user1
+    await services.get("user:3")
+    assert services.try_get("user:2") is None
+    assert services.try_get("user:1") is user1
+    await services.get("user:2")
+    assert calls == ["1", "2", "3", "2"]
+    assert len(services.services) == 0
+    assert services.cache_stats()["user"] == {
+        "size": 2,
+        "hits": 2,
+        "misses": 4,
+        "evictions": 2,
+    }
+
+
+@pytest.mark.asyncio
+async def test_ttl(services):
+    @services.factory("user", ttl=0.05)
+    def user_factory(id):
+        return User(id)
+
+    user1 = await services.get("user:1")
+    assert (await services.get("user:1")) is user1
+    await asyncio.sleep(0.06)
+    assert (await services.get("user:1")) is not user1
+    assert services.cache_stats()["user"]["evictions"] == 1
+
+
+@pytest.mark.asyncio
+async def test_ttl_purge(services):
+    @services.factory("user", ttl=0.05)
+    def user_factory(id):
+        return User(id)
+
+    await services.get_many(["user:%d" % i for i in range(1000)])
+    await asyncio.sleep(0.06)
+    await services.get_many(["user:%d" % i for i in range(1000, 1010)])
+    stats = services.cache_stats()["user"]
+    assert stats["size"] == 10
+    assert stats["evictions"] == 1000
+
+
+@pytest.mark.asyncio
+async def test_weak(services):
+    @services.factory("user", weak=True)
+    def user_factory(id):
+        return User(id)
+
+    user1 = await services.get("user:1")
+    assert services.get_nowait("user:1") is user1
+    del user1
+    await asyncio.sleep(0)
+    gc.collect()
+    assert services.try_get("user:1") is None
+
+
+@pytest.mark.asyncio
+async def test_weak_unreferenceable(services, caplog):
+    @services.factory("user", weak=True)
+    def user_factory(id):
+        return {"id": id}
+
+    assert await services.get("user:1") == {"id": "1"}
+    assert await services.get("user:2") == {"id": "2"}
+    assert services.try_get("user:1") is None
+    assert caplog.text.count("cannot hold dict services") == 1
+
+
+@pytest.mark.asyncio
+async def test_cache_refresh_and_close(services):
+    @services.factory("user", maxsize=10)
+    def user_factory(id):
+        return User(id)
+
+    user1 = await services.get("user:1")
+    assert services.refresh("user:1") is user1
+    user2 = await services.get("user:1")
+    assert user2 is not user1
+    services.close()
+    assert services.try_get("user:1") is None
@@ -0,0 +1,157 @@
+import asyncio
+from time import perf_counter
+
+import pytest
+
+from knighted import Injector, annotate
+
+
+@pytest.fixture
+def services():
+    class MyInjector(Injector):
+        pass
+
+    return MyInjector()
+
+
+class Resource:
+    def __init__(self, name, journal, delay=0.05):
+        self.name = name
+        self.journal = journal
+        self.delay = delay
+
+    async def close(self):
+        self.journal.append(("start", self.name))
+        await asyncio.sleep(self.delay)
+        self.journal.append(("end", self.name))
+
+
+@pytest.mark.asyncio
+async def test_async_close_is_concurrent(services):
+    journal = []
+    resources = [Resource(i, journal) for i in range(20)]
+    for resource in resources:
+        services.close.register(resource)
+    started_at = perf_counter()
+    report = await services.close()
+    assert perf_counter() - started_at < 0.5
+    assert len(report.closed) == 20
+    assert len(journal) == 40
+
+
+@pytest.mark.asyncio
+async def test_close_in_reverse_dependency_order(services):
+    journal = []
+
+    @services.factory("db")
+    def db_factory():
+        return Resource("db", journal)
+
+    @services.factory("repo")
+    @annotate("db")
+    def repo_factory(db):
+        return Resource("repo", journal)
+
+    @services.factory("api")
+    @annotate("repo", "db")
+    def api_factory(repo, db):
+        return Resource("api", journal)
+
+    @services.factory("cache")
+    def cache_factory():
+        return Resource("cache", journal)
+
+    for name in ("db", "repo", "api", "cache"):
+        services.close.register(await services.get(name))
+    await services.close()
+    assert journal.index(("end", "api")) < journal.index(("start", "repo"))
+    assert journal.index(("end", "repo")) < journal.index(("start", "db"))
+    assert journal.index(("start", "cache")) < journal.index(("end", "api"))
+
+
+@pytest.mark.asyncio
+async def test_close_deadline(services):
+    journal = []
+    slow = Resource("slow", journal, delay=10)
+    fast = Resource("fast", journal, delay=0)
+
+    def broken(obj):
+        raise RuntimeError
+
+    services.close.register(slow)
+    services.close.register(fast)
+    broken_obj = Resource("broken", journal)
+    services.close.register(broken_obj, reaction=broken)
+    report = await services.close(timeout=0.05)
+    assert report.missed == [slow]
+    assert fast in report.closed
+    assert [obj for obj, _ in report.failed] == [broken_obj]
+
+
+def test_close_without_loop(services):
+    journal = []
+    resource = Resource("foo", journal, delay=0)
+    services.close.register(resource)
+    report = services.close()
+    assert journal == [("start", "foo"), ("end", "foo")]
+    assert len(report.closed) == 1
+
+
+class Handle:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_close_sync_reactions_right_away(services):
+    journal = []
+
+    @services.factory("handle")
+    def handle_factory():
+        return Handle()
+
+    @services.factory("client")
+    @annotate("handle")
+    def client_factory(handle):
+        return Resource("client", journal, delay=0)
+
+    handle = await services.get("handle")
+    services.close.register(handle)
+    other = Handle()
+    services.close.register(other)
+    pending = services.close()
+    assert handle.closed and other.closed
+    report = await pending
+    assert set(report.closed) == {handle, other}
+
+    handle = await services.get("handle")
+    services.close.register(handle)
+    services.close.register(await services.get("client"))
+    pending = services.close()
+    assert not handle.closed
+    await pending
+    assert handle.closed
+    assert journal == [("start", "client"), ("end", "client")]
+
+
+@pytest.mark.asyncio
+async def test_close_cancels_pending_loads(services):
+    journal = []
+
+    @services.factory("slow")
+    async def slow_factory():
+        await asyncio.sleep(0.05)
+        journal.append("loaded")
+        return Resource("slow", journal)
+
+    loading = asyncio.ensure_future(services.get("slow"))
+    await asyncio.sleep(0)
+    await services.close()
+    with pytest.raises(asyncio.CancelledError):
+        await loading
+    await asyncio.sleep(0.1)
+    assert journal == []
+    assert "slow" not in services.services
+    assert not services.pending
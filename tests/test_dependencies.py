@@ -0,0 +1,146 @@
+import asyncio
+from time import perf_counter
+
+import pytest
+
+from knighted import Injector, annotate, CircularDependencyError
+
+
+@pytest.fixture
+def services():
+    class MyInjector(Injector):
+        pass
+
+    return MyInjector()
+
+
+@pytest.mark.asyncio
+async def test_declared_dependencies(services):
+    @services.factory("foo")
+    def foo_factory():
+        return "I am foo"
+
+    @services.factory("bar")
+    async def bar_factory():
+        return "I am bar"
+
+    @services.factory("all")
+    @annotate("foo", "bar")
+    async def together_factory(foo, bar):
+        return [foo, bar]
+
+    @services.factory("sync")
+    @annotate("all")
+    def sync_factory(all):
+        return ["sync", *all]
+
+    assert (await services.get("all")) == ["I am foo", "I am bar"]
+    assert (await services.get("sync")) == ["sync", "I am foo", "I am bar"]
+
+
+@pytest.mark.asyncio
+async def test_declared_dependencies_with_args(services):
+    @services.factory("config")
+    def config_factory():
+        return {"42": "Marvin"}
+
+    @services.factory("user")
+    @annotate(config="config")
+    def user_factory(id, config):
+        return config[id]
+
+    assert services.graph(["user:42"]) == {"user:42": ("config",), "config": ()}
+    assert (await services.get("user:42")) == "Marvin"
+
+
+@pytest.mark.asyncio
+async def test_warmup(services):
+    calls = []
+
+    async def load(name):
+        calls.append(name)
+        await asyncio.sleep(0.1)
+        return name
+
+    @services.factory("a")
+    async def a_factory():
+        return await load("a")
+
+    @services.factory("b")
+    async def b_factory():
+        return await load("b")
+
+    @services.factory("c")
+    @annotate("a", "b")
+    async def c_factory(a, b):
+        return await load("c")
+
+    @services.factory("d")
+    @annotate("c")
+    async def d_factory(c):
+        return await load("d")
+
+    @services.factory("e")
+    @annotate("a")
+    async def e_factory(a):
+        return await load("e")
+
+    assert services.graph(["d", "e"]) == {
+        "a": (),
+        "b": (),
+        "c": ("a", "b"),
+        "d": ("c",),
+        "e": ("a",),
+    }
+    started_at = perf_counter()
+    assert (await services.warmup(["d", "e"], concurrency=4)) == {"d": "d", "e": "e"}
+    assert perf_counter() - started_at < 0.45
+    assert sorted(calls) == ["a", "b", "c", "d", "e"]
+    assert services.get_nowait("c") == "c"
+
+
+@pytest.mark.asyncio
+async def test_warmup_cycle(services):
+    calls = []
+
+    @services.factory("a")
+    @annotate("b")
+    def a_factory(b):
+        calls.append("a")
+
+    @services.factory("b")
+    @annotate("a")
+    def b_factory(a):
+        calls.append("b")
+
+    @services.factory("c")
+    def c_factory():
+        calls.append("c")
+
+    with pytest.raises(CircularDependencyError):
+        await services.warmup(["c", "a"])
+    assert calls == []
+
+
+@pytest.mark.asyncio
+async def test_get_cycle(services):
+    @services.factory("a")
+    @annotate("b")
+    def a_factory(b):
+        return "a"
+
+    @services.factory("b")
+    @annotate("a")
+    def b_factory(a):
+        return "b"
+
+    @services.factory("c", singleton=False)
+    @annotate("c")
+    def c_factory(c):
+        return "c"
+
+    with pytest.raises(CircularDependencyError, match="a -> b -> a"):
+        await asyncio.wait_for(services.get("a"), 1)
+    assert not services.pending
+    with pytest.raises(CircularDependencyError, match="c -> c"):
+        await asyncio.wait_for(services.get("c"), 1)
@@ -1,6 +1,6 @@
 import pytest
 
-from knighted import Injector, attr, attr_lazy
+from knighted import Injector, attr, attr_lazy, resolve_lazy
 from typing import Any
 
 
@@ -56,3 +56,114 @@ async def test_annotated_class_attribute(services):
     result = await services.apply(Tic)
 
     assert (await result()) == {"foo": "I am foo"}
+
+
+@pytest.fixture
+def counted(services):
+    calls = []
+
+    @services.factory("foo", singleton=False)
+    async def foo_factory():
+        calls.append("foo")
+        return "I am foo"
+
+    @services.factory("bar", singleton=False)
+    def bar_factory():
+        calls.append("bar")
+        return "I am bar"
+
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_lazy_attribute_is_memoized(services, counted):
+    class Toto:
+        foo: Any = attr_lazy("foo")
+
+    toto = Toto()
+    with services.auto():
+        assert toto.foo is toto.foo
+        assert await toto.foo == "I am foo"
+        assert await toto.foo == "I am foo"
+    assert counted == ["foo"]
+
+
+@pytest.mark.asyncio
+async def test_resolve_lazy(services, counted):
+    class Base:
+        foo: Any = attr_lazy("foo")
+
+    class Toto(Base):
+        bar: Any = attr_lazy("bar")
+        other: Any = attr_lazy("foo")
+
+    toto = Toto()
+    with services.auto():
+        results = await resolve_lazy(toto)
+        assert results == {"foo": "I am foo", "bar": "I am bar", "other": "I am foo"}
+        assert await toto.bar == "I am bar"
+    assert sorted(counted) == ["bar", "foo"]
+
+
+@pytest.mark.asyncio
+async def test_lazy_attribute_with_slots(services, counted):
+    class Slotted:
+        __slots__ = ("__weakref__",)
+        foo: Any = attr_lazy("foo")
+
+    class Bare:
+        __slots__ = ()
+        foo: Any = attr_lazy("foo")
+
+    slotted = await services.apply(Slotted)
+    assert slotted.foo is slotted.foo
+    assert await slotted.foo == "I am foo"
+    assert await resolve_lazy(slotted) == {"foo": "I am foo"}
+    assert counted == ["foo"]
+
+    bare = await services.apply(Bare)
+    with services.auto():
+        assert await bare.foo == "I am foo"
+
+
+@pytest.mark.asyncio
+async def test_lazy_attribute_equal_slotted(services):
+    class Slotted:
+        __slots__ = ("__weakref__",)
+        user: Any = attr_lazy("user")
+
+        def __eq__(self, other):
+            return isinstance(other, Slotted)
+
+        def __hash__(self):
+            return 0
+
+    first, second = services.scope(), services.scope()
+    first["user"] = "alice"
+    second["user"] = "bob"
+    alice = await first.apply(Slotted)
+    bob = await second.apply(Slotted)
+    assert alice == bob
+    assert await alice.user == "alice"
+    assert await bob.user == "bob"
+
+
+@pytest.mark.asyncio
+async def test_lazy_attribute_failure_retries(services):
+    calls = []
+
+    @services.factory("flaky", singleton=False)
+    def flaky():
+        calls.append("flaky")
+        if len(calls) == 1:
+            raise RuntimeError("down")
+        return "up"
+
+    class Toto:
+        flaky: Any = attr_lazy("flaky")
+
+    toto = Toto()
+    with services.auto():
+        with pytest.raises(RuntimeError):
+            await toto.flaky
+        assert await toto.flaky == "up"
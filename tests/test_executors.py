@@ -0,0 +1,165 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+from time import sleep
+
+import pytest
+
+from knighted import Injector, bases
+
+
+@pytest.fixture
+def services():
+    class MyInjector(Injector):
+        pass
+
+    return MyInjector()
+
+
+def pid_factory(*args):
+    return os.getpid(), args
+
+
+@pytest.mark.asyncio
+async def test_default_executor(services):
+    @services.factory("foo")
+    def foo_factory():
+        return threading.get_ident()
+
+    assert (await services.get("foo")) != threading.get_ident()
+    assert services.executor_stats()["default"]["submitted"] == 1
+    assert services.executor._max_workers == Injector.max_workers
+
+
+@pytest.mark.asyncio
+async def test_inline_executor(services):
+    @services.factory("foo", executor="inline")
+    def foo_factory():
+        return threading.get_ident()
+
+    assert (await services.get("foo")) == threading.get_ident()
+
+
+@pytest.mark.asyncio
+async def test_named_thread_pool(services):
+    services.add_executor("slow", concurrent.futures.ThreadPoolExecutor(max_workers=2))
+
+    @services.factory("slow", singleton=False, executor="slow")
+    def slow_factory():
+        sleep(0.05)
+        return threading.current_thread().name
+
+    @services.factory("fast")
+    def fast_factory():
+        return "fast"
+
+    pending = [services.get("slow") for _ in range(6)]
+    assert services.executor_stats()["slow"]["queued"] == 4
+    assert (await services.get("fast")) == "fast"
+    for fut in pending:
+        await fut
+    await asyncio.sleep(0)  # let done callbacks run
+    stats = services.executor_stats()
+    assert stats["slow"]["peak_queued"] == 4
+    assert stats["slow"]["in_flight"] == 0
+    assert stats["default"]["submitted"] == 1
+
+
+@pytest.mark.asyncio
+async def test_process_pool(services):
+    services.add_executor("cpu", concurrent.futures.ProcessPoolExecutor(max_workers=1))
+    services.factory("pid", pid_factory, executor="cpu")
+    pid, args = await services.get("pid:foo")
+    assert pid != os.getpid()
+    assert args == ("foo",)
+
+
+@pytest.mark.asyncio
+async def test_executor_instance(services):
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    services.factory("foo", lambda: "I am foo", executor=executor)
+    assert (await services.get("foo")) == "I am foo"
+
+
+@pytest.mark.asyncio
+async def test_undefined_executor(services):
+    services.factory("foo", lambda: "I am foo", executor="missing")
+    with pytest.raises(ValueError):
+        await services.get("foo")
+
+
+@pytest.mark.asyncio
+async def test_configured_default_executor():
+    class MyInjector(Injector):
+        default_executor = "inline"
+
+    services = MyInjector()
+    services.factory("foo", threading.get_ident)
+    assert (await services.get("foo")) == threading.get_ident()
+
+
+@pytest.mark.asyncio
+async def test_inline_factory(services):
+    @services.factory("foo", inline=True)
+    def foo_factory():
+        return threading.get_ident()
+
+    assert (await services.get("foo")) == threading.get_ident()
+    assert services.executor_stats()["default"]["submitted"] == 0
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Clock of auto inlined factories, which advance it instead of sleeping.
+    """
+    now = [0.0]
+    monkeypatch.setattr(bases, "perf_counter", lambda: now[0])
+    return now
+
+
+@pytest.mark.asyncio
+async def test_auto_inline_factory(services, clock):
+    services.factory("fast", threading.get_ident, singleton=False, inline="auto")
+    idents = [await services.get("fast") for _ in range(5)]
+    assert idents[:3] != [threading.get_ident()] * 3
+    assert idents[3:] == [threading.get_ident()] * 2
+
+    @services.factory("slow", singleton=False, inline="auto")
+    def slow_factory():
+        clock[0] += 0.02
+        return threading.get_ident()
+
+    idents = [await services.get("slow") for _ in range(5)]
+    assert threading.get_ident() not in idents
+
+
+@pytest.mark.asyncio
+async def test_auto_inline_demotion(services, clock):
+    delays = [0, 0, 0, 0.02, 0, 0]
+
+    @services.factory("foo", singleton=False, inline="auto")
+    def foo_factory():
+        clock[0] += delays.pop(0)
+        return threading.get_ident()
+
+    idents = [await services.get("foo") for _ in range(6)]
+    assert idents[3] == threading.get_ident()
+    assert threading.get_ident() not in idents[4:]
+
+
+@pytest.mark.asyncio
+async def test_inline_blocking_warning(services, caplog):
+    @services.factory("foo", inline=True)
+    def foo_factory():
+        sleep(0.02)
+        return "I am foo"
+
+    @services.factory("bar", inline=True)
+    def bar_factory():
+        return "I am bar"
+
+    assert (await services.get("bar")) == "I am bar"
+    assert "blocked the loop" not in caplog.text
+    assert (await services.get("foo")) == "I am foo"
+    assert "blocked the loop" in caplog.text
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from knighted import Injector, ServiceFailedError
+
+
+@pytest.fixture
+def services():
+    class MyInjector(Injector):
+        track_stats = True
+
+    return MyInjector()
+
+
+@pytest.mark.asyncio
+async def test_failure_reaches_every_waiter(services):
+    calls = []
+
+    @services.factory("broken")
+    async def broken():
+        calls.append("broken")
+        await asyncio.sleep(0.01)
+        raise RuntimeError("down")
+
+    results = await asyncio.wait_for(
+        asyncio.gather(*(services.get("broken") for _ in range(3)), return_exceptions=True),
+        1,
+    )
+    assert [type(result) for result in results] == [RuntimeError] * 3
+    assert calls == ["broken"]
+    assert "broken" not in services.pending
+
+    # without negative cache, the next call retries
+    with pytest.raises(RuntimeError):
+        await services.get("broken")
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_negative_cache(services):
+    calls = []
+
+    @services.factory("broken", negative_ttl=0.05)
+    def broken():
+        calls.append("broken")
+        if len(calls) < 3:
+            raise RuntimeError("down")
+        return "up"
+
+    with pytest.raises(RuntimeError):
+        await services.get("broken")
+    with pytest.raises(ServiceFailedError) as excinfo:
+        await services.get("broken")
+    assert isinstance(excinfo.value.__cause__, RuntimeError)
+    assert calls == ["broken"]
+
+    await asyncio.sleep(0.06)
+    with pytest.raises(RuntimeError):
+        await services.get("broken")
+    assert services.failures["broken"][1] == 2
+
+    # backoff doubles after each consecutive failure
+    await asyncio.sleep(0.06)
+    with pytest.raises(ServiceFailedError):
+        await services.get("broken")
+    await asyncio.sleep(0.06)
+    assert await services.get("broken") == "up"
+    assert "broken" not in services.failures
+    assert calls == ["broken"] * 3
+
+    stats = services.stats()["services"]["broken"]
+    assert stats["failures"] == 2
+    assert stats["backoffs"] == 2
+
+
+@pytest.mark.asyncio
+async def test_refresh_resets_backoff(services):
+    calls = []
+
+    @services.factory("broken", negative_ttl=60)
+    def broken():
+        calls.append("broken")
+        if len(calls) < 2:
+            raise RuntimeError("down")
+        return "up"
+
+    with pytest.raises(RuntimeError):
+        await services.get("broken")
+    with pytest.raises(ServiceFailedError):
+        await services.get("broken")
+    services.refresh("broken")
+    assert await services.get("broken") == "up"
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+
+import pytest
+
+from knighted import Injector, annotate
+from knighted.hooks import EventLogger
+
+
+class Recorder:
+    def __init__(self):
+        self.events = []
+
+    def on_resolve_start(self, name, key, state):
+        self.events.append(("start", name, state))
+
+    def on_resolve_end(self, name, key, timing, error):
+        self.events.append(("end", name, type(error)))
+        assert timing.wait >= 0
+        assert timing.run >= 0
+
+    def on_apply(self, func, names):
+        self.events.append(("apply", func.__name__, names))
+
+    def on_close(self, report):
+        self.events.append(("close", len(report.closed)))
+
+
+@pytest.mark.asyncio
+async def test_subscriber():
+    class MyInjector(Injector):
+        track_stats = False
+
+    services = MyInjector()
+    recorder = services.hooks.subscribe(Recorder())
+
+    @services.factory("foo")
+    def foo_factory():
+        return "I am foo"
+
+    @services.factory("broken", singleton=False)
+    async def broken_factory():
+        raise RuntimeError
+
+    @annotate("foo")
+    def fun(foo):
+        return foo
+
+    await asyncio.gather(services.get("foo"), services.get("foo"))
+    await services.apply(fun)
+    with pytest.raises(RuntimeError):
+        await services.get("broken")
+    await services.close()
+    assert recorder.events == [
+        ("start", "foo", "load"),
+        ("start", "foo", "join"),
+        ("end", "foo", type(None)),
+        ("start", "foo", "hit"),
+        ("apply", "fun", ["foo"]),
+        ("start", "broken", "load"),
+        ("end", "broken", RuntimeError),
+        ("close", 0),
+    ]
+    assert services.stats()["services"] == {}
+
+    services.hooks.unsubscribe(recorder)
+    assert services.hooks.on_resolve_start == []
+
+
+@pytest.mark.asyncio
+async def test_event_logger(caplog):
+    class MyInjector(Injector):
+        log_events = True
+
+    services = MyInjector()
+
+    @services.factory("foo")
+    def foo_factory():
+        return "I am foo"
+
+    @annotate("foo")
+    def fun(foo):
+        return foo
+
+    with caplog.at_level(logging.INFO, logger="knighted"):
+        await services.apply(fun)
+    assert "Loading service=foo" in caplog.text
+    assert "Apply services=foo" in caplog.text
+    assert isinstance(services.hooks.on_apply[0].__self__, EventLogger)
@@ -310,3 +310,259 @@ async def test_service_context(services):
 
     assert func() is None
     assert (await services.apply(func)) is services
+
+
+@pytest.mark.asyncio
+async def test_concurrent_singleton_get(services):
+    calls = []
+
+    @services.factory("foo")
+    def foo_factory():
+        calls.append(1)
+        sleep(0.05)
+        return object()
+
+    @services.factory("bar")
+    async def bar_factory():
+        calls.append(2)
+        await asyncio.sleep(0.05)
+        return object()
+
+    foos = await asyncio.gather(*(services.get("foo") for _ in range(200)))
+    bars = await asyncio.gather(*(services.get("bar") for _ in range(200)))
+    assert calls == [1, 2]
+    assert len({id(foo) for foo in foos}) == 1
+    assert len({id(bar) for bar in bars}) == 1
+    assert not services.pending
+
+
+@pytest.mark.asyncio
+async def test_concurrent_not_singleton_get(services):
+    calls = []
+
+    @services.factory("foo", singleton=False)
+    async def foo_factory():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return object()
+
+    await asyncio.gather(*(services.get("foo") for _ in range(50)))
+    assert len(calls) == 50
+
+
+@pytest.mark.asyncio
+async def test_prefix_resolution(services):
+    @services.factory("user")
+    def user_factory(*args):
+        return ["user", *args]
+
+    @services.factory("user:admin")
+    def admin_factory(*args):
+        return ["admin", *args]
+
+    assert (await services.get("user:42:profile")) == ["user", "42", "profile"]
+    assert (await services.get("user:admin:42")) == ["admin", "42"]
+    assert (await services.get("user:admin")) == ["admin"]
+    with pytest.raises(ValueError):
+        await services.get("users:42")
+
+
+@pytest.mark.asyncio
+async def test_resolution_cache_invalidation():
+    class MyInjector(Injector):
+        pass
+
+    services = MyInjector()
+
+    @services.factory("user", singleton=False)
+    def user_factory(*args):
+        return ["user", *args]
+
+    assert (await services.get("user:42:profile")) == ["user", "42", "profile"]
+    assert "user:42:profile" in services.resolve.cache
+
+    @MyInjector.factory("user:42", singleton=False)
+    def user_42_factory(*args):
+        return ["user 42", *args]
+
+    assert (await services.get("user:42:profile")) == ["user 42", "profile"]
+
+
+@pytest.mark.asyncio
+async def test_resolution_cache_scopes(services):
+    services.factory("user", lambda id: id, singleton=False)
+    assert await services.get("user:1") == "1"
+    resolver = services.resolve
+
+    # scopes registering factories keep the resolutions of their parent
+    scope = services.scope()
+    scope.factory("local", lambda: "local")
+    assert await scope.get("local") == "local"
+    assert await scope.get("user:2") == "2"
+    assert not resolver.stale
+    assert "user:1" in resolver.cache
+
+    # but see later factories of their parent
+    services.factory("user:admin", lambda: "admin")
+    assert await scope.get("user:admin") == "admin"
+    assert await services.get("user:admin") == "admin"
+
+
+@pytest.mark.asyncio
+async def test_get_nowait(services):
+    @services.factory("foo")
+    def foo_factory():
+        return "I am foo"
+
+    with pytest.raises(KeyError):
+        services.get_nowait("foo")
+    assert services.try_get("foo") is None
+    assert services.try_get("foo", "default") == "default"
+    await services.get("foo")
+    assert services.get_nowait("foo") == "I am foo"
+    assert services.try_get("foo") == "I am foo"
+
+
+@pytest.mark.asyncio
+async def test_get_nowait_allocations(services):
+    import tracemalloc
+
+    rounds = range(100)
+
+    def peak(func):
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        for _ in rounds:
+            func("foo")
+        return tracemalloc.get_traced_memory()[1] - current
+
+    services["foo"] = "I am foo"
+    services.get_nowait("foo")
+    tracemalloc.start()
+    try:
+        # the loop itself allocates its iterator
+        overhead = peak(len)
+        assert peak(services.get_nowait) == overhead
+        assert peak(services.try_get) == overhead
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.asyncio
+async def test_apply_loaded_services(services):
+    services["foo"] = "I am foo"
+
+    @annotate("foo")
+    def fun(foo):
+        return {"foo": foo}
+
+    @annotate("foo")
+    def broken(foo):
+        raise RuntimeError(foo)
+
+    result = services.apply(fun)
+    assert result.done()
+    assert (await result) == {"foo": "I am foo"}
+    with pytest.raises(RuntimeError):
+        await services.apply(broken)
+
+
+def test_injection_plan():
+    from knighted.bases import ANNOTATIONS
+
+    @annotate("foo", baz="baz")
+    def fun(foo, bar=None, *, baz, qux=None):
+        ...
+
+    anno = ANNOTATIONS[fun]
+    anno.bind_partial = None  # plain signatures never bind
+    assert anno.missing((), {}) == (("foo", "foo"), ("baz", "baz"))
+    assert anno.missing((1,), {}) == [("baz", "baz")]
+    assert anno.missing((), {"foo": 1}) == [("baz", "baz")]
+    assert anno.missing((1,), {"baz": 2}) == []
+    assert anno.missing((), {"qux": 2}) == [("foo", "foo"), ("baz", "baz")]
+
+
+def test_injection_plan_fallback():
+    from knighted.bases import ANNOTATIONS
+
+    @annotate("foo")
+    def fun(foo, *args):
+        ...
+
+    anno = ANNOTATIONS[fun]
+    assert anno.missing((1, 2, 3), {}) == []
+    assert anno.missing((), {}) == (("foo", "foo"),)
+
+
+def test_version_is_lazy():
+    import subprocess
+    import sys
+
+    code = (
+        "import sys, knighted; "
+        "assert 'knighted._version' not in sys.modules; "
+        "assert knighted.__version__; "
+        "assert 'knighted._version' in sys.modules"
+    )
+    subprocess.check_call([sys.executable, "-c", code])
+
+
+@pytest.mark.asyncio
+async def test_get_many(services):
+    calls = []
+
+    @services.factory("foo")
+    async def foo():
+        calls.append("foo")
+        await asyncio.sleep(0.01)
+        return "foo"
+
+    @services.factory("bar")
+    async def bar():
+        calls.append("bar")
+        await asyncio.sleep(0.01)
+        return "bar"
+
+    services["baz"] = "baz"
+    results = await services.get_many(["foo", "bar", "baz", "foo"])
+    assert results == {"foo": "foo", "bar": "bar", "baz": "baz"}
+    assert calls == ["foo", "bar"]
+
+    # everything is loaded, the future is already resolved
+    future = services.get_many(["foo", "baz"])
+    assert future.done()
+    assert future.result() == {"foo": "foo", "baz": "baz"}
+
+
+@pytest.mark.asyncio
+async def test_lazy_markers(services):
+    from knighted import lazy
+
+    calls = []
+
+    @services.factory("reporter")
+    def reporter():
+        calls.append("reporter")
+        return "reporter"
+
+    @services.factory("handler")
+    @annotate(reporter=lazy("reporter"))
+    async def handler(reporter):
+        return reporter
+
+    @annotate("foo", reporter=lazy("reporter"))
+    async def fun(foo, reporter, fail=False):
+        if fail:
+            return await reporter, await reporter
+        return foo
+
+    services["foo"] = "foo"
+    assert await services.apply(fun) == "foo"
+    assert calls == []
+    assert await services.apply(fun, fail=True) == ("reporter", "reporter")
+    assert calls == ["reporter"]
+
+    handle = await services.get("handler")
+    assert await handle == "reporter"
+    assert services.graph(["handler"]) == {"handler": ()}
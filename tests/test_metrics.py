@@ -0,0 +1,83 @@
+import asyncio
+from time import sleep
+
+import pytest
+
+from knighted import Injector, annotate
+from knighted.metrics import render_prometheus
+
+
+@pytest.fixture
+def services():
+    class MyInjector(Injector):
+        track_stats = True
+
+    return MyInjector()
+
+
+@pytest.mark.asyncio
+async def test_stats(services):
+    @services.factory("foo")
+    def foo_factory():
+        sleep(0.01)
+        return "I am foo"
+
+    @services.factory("bar")
+    @annotate("foo")
+    async def bar_factory(foo):
+        await asyncio.sleep(0.01)
+        return "I am bar"
+
+    @services.factory("broken", singleton=False)
+    async def broken_factory():
+        raise RuntimeError
+
+    await asyncio.gather(services.get("bar"), services.get("bar"))
+    await services.get("bar")
+    with pytest.raises(RuntimeError):
+        await services.get("broken")
+
+    stats = services.stats()["services"]
+    assert stats["bar"]["calls"] == 1
+    assert stats["bar"]["misses"] == 2
+    assert stats["bar"]["hits"] == 1
+    assert stats["bar"]["in_flight"] == 0
+    assert stats["foo"]["calls"] == 1
+    assert stats["bar"]["wait"]["sum"] >= 0.01
+    assert 0.01 <= stats["bar"]["run"]["sum"] < 0.02
+    assert stats["foo"]["run"]["sum"] >= 0.01
+    assert stats["foo"]["run"]["buckets"][0.05] == 1
+    assert stats["foo"]["run"]["buckets"][0.005] == 0
+    assert stats["broken"]["failures"] == 1
+
+
+@pytest.mark.asyncio
+async def test_bounded_stats_are_grouped(services):
+    @services.factory("user", maxsize=10)
+    def user_factory(id):
+        return id
+
+    for id in (1, 2, 1):
+        await services.get("user:%s" % id)
+    stats = services.stats()
+    assert stats["services"]["user"]["calls"] == 2
+    assert stats["services"]["user"]["hits"] == 1
+    assert stats["caches"]["user"]["size"] == 2
+
+
+@pytest.mark.asyncio
+async def test_render_prometheus(services):
+    @services.factory("foo")
+    def foo_factory():
+        return "I am foo"
+
+    await services.get("foo")
+    services["quoted\"name"] = "value"
+    await services.get("quoted\"name")
+    text = render_prometheus(services.stats())
+    assert '# TYPE knighted_service_calls_total counter' in text
+    assert 'knighted_service_calls_total{service="foo"} 1\n' in text
+    assert 'knighted_service_hits_total{service="quoted\\"name"} 1\n' in text
+    assert 'knighted_service_run_seconds_bucket{service="foo",le="+Inf"} 1\n' in text
+    assert 'knighted_service_run_seconds_count{service="foo"} 1\n' in text
+    assert 'knighted_executor_submitted_total{executor="default"} 1\n' in text
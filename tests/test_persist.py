@@ -0,0 +1,97 @@
+import pytest
+
+from knighted import Injector
+from knighted.persist import SnapshotStore
+
+
+@pytest.fixture
+def injector_class(tmp_path):
+    class MyInjector(Injector):
+        persist_dir = str(tmp_path / "snapshots")
+
+    return MyInjector
+
+
+@pytest.mark.asyncio
+async def test_persisted_factory(injector_class):
+    calls = []
+
+    def tables():
+        calls.append("tables")
+        return {"a": list(range(10))}
+
+    services = injector_class()
+    services.factory("tables", tables, persist=True, key="v1")
+    assert await services.get("tables") == {"a": list(range(10))}
+
+    # next boot loads the snapshot
+    services = injector_class()
+    services.factory("tables", tables, persist=True, key="v1")
+    assert await services.get("tables") == {"a": list(range(10))}
+    assert calls == ["tables"]
+
+    # a new fingerprint replaces the snapshot
+    services = injector_class()
+    services.factory("tables", tables, persist=True, key="v2")
+    await services.get("tables")
+    assert calls == ["tables", "tables"]
+    assert services.store.stats()["snapshots"] == 1
+
+
+@pytest.mark.asyncio
+async def test_persisted_parameterized_factory(injector_class):
+    calls = []
+
+    def table(lang):
+        calls.append(lang)
+        return "table %s" % lang
+
+    for _ in range(2):
+        services = injector_class()
+        services.factory("table", table, persist=True, key=lambda lang: "v1-%s" % lang)
+        assert await services.get("table:en") == "table en"
+        assert await services.get("table:fr") == "table fr"
+    assert calls == ["en", "fr"]
+
+
+def test_persist_needs_key(injector_class):
+    with pytest.raises(ValueError):
+        injector_class().factory("tables", dict, persist=True)
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"persist": True, "key": "v1", "batch": True},
+        {"persist": True, "key": "v1", "pool": 2},
+        {"batch": True, "pool": 2},
+        {"pool": 2, "maxsize": 10},
+        {"pool": 2, "refresh_every": 60},
+        {"singleton": False, "refresh_every": 60},
+    ],
+)
+def test_incompatible_options(injector_class, options):
+    with pytest.raises(ValueError):
+        injector_class().factory("tables", dict, **options)
+
+
+def test_store(tmp_path):
+    store = SnapshotStore(tmp_path, max_bytes=300)
+    with pytest.raises(KeyError):
+        store.load("foo", "v1")
+    store.save("foo", "v1", "x" * 100)
+    assert store.load("foo", "v1") == "x" * 100
+    assert not list(tmp_path.glob("*.tmp"))
+
+    # corrupted snapshots are dropped
+    store.path("foo", "v1").write_bytes(b"garbage")
+    with pytest.raises(KeyError):
+        store.load("foo", "v1")
+    assert not store.path("foo", "v1").exists()
+
+    # least recently used snapshots are removed above max_bytes
+    for name in ("a", "b", "c"):
+        store.save(name, "v1", "x" * 100)
+    assert not store.path("a", "v1").exists()
+    assert store.path("c", "v1").exists()
+    assert store.stats()["bytes"] <= 300
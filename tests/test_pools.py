@@ -0,0 +1,199 @@
+import asyncio
+
+import pytest
+
+from knighted import Injector, annotate, lazy
+
+
+@pytest.fixture
+def services():
+    class MyInjector(Injector):
+        pass
+
+    return MyInjector()
+
+
+class Session:
+    created = 0
+
+    def __init__(self):
+        Session.created += 1
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def session_factory():
+    Session.created = 0
+
+    async def factory():
+        await asyncio.sleep(0)
+        return Session()
+
+    return factory
+
+
+@pytest.mark.asyncio
+async def test_pooled_apply(services, session_factory):
+    services.factory("session", session_factory, pool=2)
+    seen = []
+
+    @annotate("session")
+    async def fun(session):
+        seen.append(session)
+        await asyncio.sleep(0.01)
+        return session
+
+    await asyncio.gather(*(services.apply(fun) for _ in range(10)))
+    assert Session.created == 2
+    assert len({id(session) for session in seen}) == 2
+    assert services.pool_stats()["session"] == {
+        "size": 2,
+        "idle": 2,
+        "borrowed": 0,
+        "waiting": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_pooled_release_on_error(services, session_factory):
+    services.factory("session", session_factory, pool=1)
+
+    @annotate("session")
+    def fun(session):
+        raise RuntimeError
+
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            await services.apply(fun)
+    assert services.pool_stats()["session"]["idle"] == 1
+
+
+@pytest.mark.asyncio
+async def test_pooled_borrow(services, session_factory):
+    services.factory("session", session_factory, pool=1, acquire_timeout=0.01)
+    async with services.borrow("session") as session:
+        with pytest.raises(asyncio.TimeoutError):
+            await services.get("session")
+    assert (await services.get("session")) is session
+    services.release("session", session)
+    assert services.pool_stats()["session"]["waiting"] == 0
+
+
+@pytest.mark.asyncio
+async def test_pool_min_and_idle_eviction(services, session_factory):
+    services.factory("session", session_factory, pool=5, pool_min=2, idle_timeout=0.01)
+    sessions = await asyncio.gather(*(services.get("session") for _ in range(4)))
+    assert Session.created == 4
+    for session in sessions:
+        services.release("session", session)
+    await asyncio.sleep(0.02)
+    async with services.borrow("session"):
+        assert services.pool_stats()["session"]["size"] == 2
+    assert sum(session.closed for session in sessions) == 2
+
+
+@pytest.mark.asyncio
+async def test_pool_drains_on_close(services, session_factory):
+    services.factory("session", session_factory, pool=2)
+    session1, session2 = await asyncio.gather(
+        services.get("session"), services.get("session")
+    )
+    services.release("session", session1)
+    await services.close()
+    assert session1.closed
+    assert not session2.closed
+    services.release("session", session2)
+    assert session2.closed
+    assert services.pool_stats() == {}
+
+
+@pytest.mark.asyncio
+async def test_pooled_dependency(services, session_factory):
+    services.factory("session", session_factory, pool=2, acquire_timeout=0.2)
+
+    @services.factory("repo", singleton=False)
+    @annotate("session")
+    def repo_factory(session):
+        return ("repo", session)
+
+    for _ in range(5):
+        await services.get("repo")
+    assert Session.created == 1
+    assert services.pool_stats()["session"]["borrowed"] == 0
+
+
+@pytest.mark.asyncio
+async def test_pooled_apply_timeout(services, session_factory):
+    services.factory("session", session_factory, pool=1, acquire_timeout=0.2)
+
+    @services.factory("slow")
+    async def slow():
+        await asyncio.sleep(10)
+
+    @annotate("session", "slow")
+    def fun(session, slow):
+        return session
+
+    with pytest.raises(asyncio.TimeoutError):
+        await services.partial(fun, timeout=0.05)()
+    assert services.pool_stats()["session"]["borrowed"] == 0
+    async with services.borrow("session"):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_pooled_apply_failure(services, session_factory):
+    services.factory("session", session_factory, pool=1, acquire_timeout=0.2)
+
+    @services.factory("broken", singleton=False)
+    async def broken():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("down")
+
+    @annotate("broken", "session")
+    def fun(broken, session):
+        return session
+
+    with pytest.raises(RuntimeError):
+        await services.apply(fun)
+    await asyncio.sleep(0)
+    assert services.pool_stats()["session"]["borrowed"] == 0
+    async with services.borrow("session"):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_pooled_handover_cancelled(services, session_factory):
+    services.factory("session", session_factory, pool=1)
+    session = await services.get("session")
+    waiting = services.get("session")
+    await asyncio.sleep(0)
+    services.release("session", session)
+    waiting.cancel()
+    await asyncio.sleep(0)
+
+    assert services.pool_stats()["session"]["borrowed"] == 0
+    assert await asyncio.wait_for(services.get("session"), 1) is session
+
+
+@pytest.mark.asyncio
+async def test_pooled_lazy(services, session_factory):
+    services.factory("session", session_factory, pool=1, acquire_timeout=0.2)
+
+    @annotate(session=lazy("session"))
+    async def fun(session):
+        return await session
+
+    @services.factory("repo", singleton=False)
+    @annotate(session=lazy("session"))
+    async def repo_factory(session):
+        return ("repo", await session)
+
+    for _ in range(3):
+        await services.apply(fun)
+        await services.get("repo")
+    assert Session.created == 1
+    assert services.pool_stats()["session"]["borrowed"] == 0
@@ -0,0 +1,131 @@
+import asyncio
+import concurrent.futures
+import gc
+import json
+import os
+
+import pytest
+
+from knighted import Injector
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(os, "fork"), reason="forking is not supported on this platform"
+)
+
+
+class Connection:
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def services():
+    class MyInjector(Injector):
+        pass
+
+    yield MyInjector()
+    gc.unfreeze()
+
+
+def forked(check):
+    """Runs check in a forked child, and returns what it returned.
+    """
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        try:
+            result = check()
+        except BaseException as error:
+            result = repr(error)
+        with os.fdopen(write, "w") as file:
+            json.dump(result, file)
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as file:
+        result = json.load(file)
+    os.waitpid(pid, 0)
+    return result
+
+
+def test_prefork(services):
+    services["plain"] = "plain"
+
+    @services.factory("table", fork_safe=True)
+    def table():
+        return {"a": 1}
+
+    @services.factory("config")
+    def config():
+        return {"debug": False}
+
+    @services.factory("conn")
+    def conn():
+        connection = Connection()
+        services.close.register(connection)
+        return connection
+
+    async def warm():
+        await services.get("table")
+        await services.get("conn")
+        return await services.prefork(["config"])
+
+    assert asyncio.run(warm()) == {"config": {"debug": False}}
+    assert gc.get_freeze_count() == 0
+    tables = services.get_nowait("table")
+    executor = services.executors["default"].executor
+
+    def check():
+        return {
+            "table": services.get_nowait("table") is tables,
+            "loaded": sorted(services.services.maps[0]),
+            "executor": services.executors["default"].executor is not executor,
+            "registry": len(services.close.registry),
+        }
+
+    assert forked(check) == {
+        "table": True,
+        "loaded": ["config", "table"],
+        "executor": True,
+        "registry": 0,
+    }
+    # the parent keeps everything
+    assert services.get_nowait("conn")
+    assert services.get_nowait("plain") == "plain"
+    assert len(services.close.registry) == 1
+
+
+def test_prefork_executors(services):
+    services.add_executor("cpu", concurrent.futures.ThreadPoolExecutor(2))
+
+    @services.factory("square", singleton=False, executor="cpu")
+    def square(n):
+        return int(n) ** 2
+
+    async def warm():
+        assert await services.get("square:3") == 9
+        await services.prefork(freeze=True)
+
+    asyncio.run(warm())
+    assert gc.get_freeze_count() > 0
+
+    async def load():
+        return await services.get("square:4")
+
+    def check():
+        return asyncio.run(load())
+
+    assert forked(check) == 16
+
+
+def test_prefork_scope(services):
+    @services.factory("table", fork_safe=True)
+    def table():
+        return {"a": 1}
+
+    scope = services.scope()
+    scope["user"] = "alice"
+    assert asyncio.run(scope.prefork(["user"])) == {"user": "alice"}
+    assert scope.is_fork_safe("user")
+    assert scope.is_fork_safe("table")
+    assert not services.is_fork_safe("user")
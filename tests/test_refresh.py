@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from knighted import Injector
+
+
+@pytest.fixture
+def services():
+    class MyInjector(Injector):
+        pass
+
+    return MyInjector()
+
+
+class Credentials:
+    def __init__(self, version):
+        self.version = version
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def rotating(services):
+    versions = []
+
+    @services.factory("credentials")
+    async def credentials():
+        versions.append(len(versions) + 1)
+        await asyncio.sleep(0.01)
+        credentials = Credentials(versions[-1])
+        services.close.register(credentials)
+        return credentials
+
+    return versions
+
+
+@pytest.mark.asyncio
+async def test_background_refresh(services, rotating):
+    old = await services.get("credentials")
+    first = services.refresh("credentials", background=True, close=True)
+    second = services.refresh("credentials", background=True)
+    assert first is second
+
+    # the current service is served while the new one loads
+    assert await services.get("credentials") is old
+    assert services.get_nowait("credentials") is old
+
+    new = await first
+    await asyncio.sleep(0)
+    assert new.version == 2
+    assert services.get_nowait("credentials") is new
+    assert old.closed
+    assert not new.closed
+    assert rotating == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_background_refresh_failure(services):
+    calls = []
+
+    @services.factory("config")
+    def config():
+        calls.append("config")
+        if len(calls) > 1:
+            raise RuntimeError("down")
+        return "v1"
+
+    assert await services.get("config") == "v1"
+    with pytest.raises(RuntimeError):
+        await services.refresh("config", background=True)
+    assert await services.get("config") == "v1"
+
+
+@pytest.mark.asyncio
+async def test_background_refresh_not_loaded(services, rotating):
+    credentials = await services.refresh("credentials", background=True)
+    assert credentials.version == 1
+    assert services.get_nowait("credentials") is credentials
+
+
+@pytest.mark.asyncio
+async def test_refresh_every(services):
+    versions = []
+
+    @services.factory("token", refresh_every=0.02)
+    def token():
+        versions.append(len(versions) + 1)
+        return versions[-1]
+
+    @services.factory("other", refresh_every=0.03)
+    def other():
+        return "other"
+
+    assert await services.get("token") == 1
+    await services.get("other")
+    assert services.scheduler.task is not None
+    await asyncio.sleep(0.05)
+    assert services.get_nowait("token") >= 2
+
+    await services.close()
+    await asyncio.sleep(0)
+    assert services.scheduler.task is None
+
+
+@pytest.mark.asyncio
+async def test_refresh_every_bounded(services):
+    calls = []
+
+    @services.factory("user", maxsize=2, refresh_every=0.05)
+    def user(id):
+        calls.append(id)
+        return id
+
+    for i in range(10):
+        await services.get("user:%d" % i)
+    await asyncio.sleep(0.12)
+    assert sorted(services.scheduler.due) == ["user:8", "user:9"]
+    assert set(calls[10:]) == {"8", "9"}
+
+    services.refresh("user:9")
+    assert sorted(services.scheduler.due) == ["user:8"]
+    await services.close()
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from knighted import Injector, annotate
+
+
+@pytest.fixture
+def services():
+    class MyInjector(Injector):
+        pass
+
+    return MyInjector()
+
+
+class Resource:
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_scope_values(services):
+    services["app"] = "app"
+    scope = services.scope()
+    scope["user"] = "alice"
+
+    assert await scope.get("app") == "app"
+    assert await scope.get("user") == "alice"
+    with pytest.raises(ValueError):
+        await services.get("user")
+
+    # later writes of the parent are visible to its scopes
+    services["other"] = "other"
+    assert await scope.get("other") == "other"
+
+
+@pytest.mark.asyncio
+async def test_scope_shares_singletons(services):
+    calls = []
+
+    @services.factory("db")
+    def db():
+        calls.append("db")
+        return Resource("db")
+
+    first, second = services.scope(), services.scope()
+    results = await asyncio.gather(first.get("db"), second.get("db"))
+    assert results[0] is results[1]
+    assert await services.get("db") is results[0]
+    assert calls == ["db"]
+    assert "db" not in first.services.maps[0]
+
+
+@pytest.mark.asyncio
+async def test_scoped_factories(services):
+    @services.factory("session", scoped=True)
+    @annotate("db", "user")
+    def session(db, user):
+        return Resource("%s of %s" % (db, user))
+
+    services["db"] = "db"
+    first, second = services.scope(), services.scope()
+    first["user"] = "alice"
+    second["user"] = "bob"
+
+    alice = await first.get("session")
+    assert alice.name == "db of alice"
+    assert await first.get("session") is alice
+    assert (await second.get("session")).name == "db of bob"
+    assert "session" not in services.services
+
+
+@pytest.mark.asyncio
+async def test_scope_factories(services):
+    scope = services.scope()
+    scope.factory("local", lambda: "local")
+    assert await scope.get("local") == "local"
+    with pytest.raises(ValueError):
+        await services.get("local")
+
+
+@pytest.mark.asyncio
+async def test_scope_close(services):
+    @services.factory("db")
+    def db():
+        resource = Resource("db")
+        services.close.register(resource)
+        return resource
+
+    @services.factory("session", scoped=True)
+    def session():
+        return Resource("session")
+
+    async with services.scope() as scope:
+        database = await scope.get("db")
+        resource = await scope.get("session")
+        scope.close.register(resource)
+
+    assert resource.closed
+    assert not database.closed
+    assert await services.get("db") is database
+
+
+def test_scope_setup():
+    class MyInjector(Injector):
+        def setup(self, parent=None):
+            super().setup(parent)
+            self.requests = []
+
+    services = MyInjector()
+    scope = services.scope()
+    assert scope.parent is services
+    assert scope.requests == []
+    assert scope.requests is not services.requests
+    assert scope.hooks is services.hooks
+    assert scope.fork_safe == frozenset()
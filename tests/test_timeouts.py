@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from knighted import Injector, ResolveTimeoutError, annotate
+
+
+@pytest.fixture
+def services():
+    class MyInjector(Injector):
+        pass
+
+    return MyInjector()
+
+
+@pytest.fixture
+def slow_chain(services):
+    started, cancelled = [], []
+
+    @services.factory("slow")
+    async def slow():
+        started.append("slow")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append("slow")
+            raise
+
+    @services.factory("db")
+    @annotate("slow")
+    async def db(slow):
+        return "db"
+
+    @services.factory("fast")
+    async def fast():
+        return "fast"
+
+    return started, cancelled
+
+
+@pytest.mark.asyncio
+async def test_get_timeout(services, slow_chain):
+    started, cancelled = slow_chain
+    with pytest.raises(ResolveTimeoutError) as excinfo:
+        await services.get("db", timeout=0.01)
+    assert excinfo.value.service == "db"
+    assert excinfo.value.path == ["db", "slow"]
+    assert "'slow'" in str(excinfo.value)
+
+    await asyncio.sleep(0.01)
+    assert cancelled == ["slow"]
+    assert not services.pending
+    assert not services.waiters
+    assert await services.get("fast", timeout=1) == "fast"
+
+
+@pytest.mark.asyncio
+async def test_cancel_keeps_shared_loads(services, slow_chain):
+    started, cancelled = slow_chain
+    first, second = services.get("slow"), services.get("slow")
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0.01)
+    assert cancelled == []
+    second.cancel()
+    await asyncio.sleep(0.01)
+    assert cancelled == ["slow"]
+    assert started == ["slow"]
+
+
+@pytest.mark.asyncio
+async def test_cancel_apply(services, slow_chain):
+    started, cancelled = slow_chain
+
+    @annotate("fast", "db")
+    def fun(fast, db):
+        return fast, db
+
+    task = services.apply(fun)
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    await asyncio.sleep(0.01)
+    assert cancelled == ["slow"]
+    assert not services.pending
+
+
+@pytest.mark.asyncio
+async def test_partial_timeout(services, slow_chain):
+    @annotate("fast", "db")
+    def fun(fast, db):
+        return fast, db
+
+    parted = services.partial(fun, timeout=0.01)
+    with pytest.raises(ResolveTimeoutError) as excinfo:
+        await parted()
+    assert excinfo.value.path == ["db", "slow"]
+
+
+@pytest.mark.asyncio
+async def test_apply_deadline(services, slow_chain):
+    @annotate("fast")
+    def quick(fast):
+        return fast
+
+    @annotate("db")
+    def stuck(db):
+        return db
+
+    with services.deadline(0.01):
+        assert await services.apply(quick) == "fast"
+        with pytest.raises(ResolveTimeoutError):
+            await services.apply(stuck)
+
+
+@pytest.mark.asyncio
+async def test_get_deadline(services, slow_chain):
+    started, cancelled = slow_chain
+    with services.deadline(0.01):
+        assert await services.get("fast") == "fast"
+        with pytest.raises(ResolveTimeoutError) as excinfo:
+            await asyncio.wait_for(services.get("db"), 1)
+    assert excinfo.value.path == ["db", "slow"]
+
+    await asyncio.sleep(0.01)
+    assert cancelled == ["slow"]
+    assert not services.pending